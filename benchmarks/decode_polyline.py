@@ -0,0 +1,41 @@
+"""Compare route decoding with openrouteservice decoder.
+
+Run from the repository root: python -m benchmarks.decode_polyline
+"""
+import random
+import timeit
+
+from openrouteservice import convert
+
+from taxi_bot.api_service.geometry import Route, encode_polyline
+
+
+def decode_lists(polyline):
+    """Decode route the way it was decoded before Route."""
+    coordinates = convert.decode_polyline(polyline)["coordinates"]
+    return {
+        "lon": tuple(c[0] for c in coordinates),
+        "lat": tuple(c[1] for c in coordinates),
+        "polyline": polyline,
+    }
+
+
+def main():
+    """Print decoding time of long routes."""
+    random.seed(0)
+    for points in (1_000, 10_000, 100_000):
+        lon, lat = 100.5, 13.7
+        coordinates = []
+        for _ in range(points):
+            lon += random.uniform(-0.001, 0.001)
+            lat += random.uniform(-0.001, 0.001)
+            coordinates.append((lon, lat))
+        polyline = encode_polyline(coordinates)
+        number = max(1, 100_000 // points)
+        for name, decode in (("openrouteservice", decode_lists), ("Route.decode", Route.decode)):
+            seconds = timeit.timeit(lambda: decode(polyline), number=number) / number
+            print(f"{points:>7} points {name:>16}: {seconds * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
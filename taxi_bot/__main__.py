@@ -2,4 +2,6 @@
 
 from taxi_bot.cli import main
 
-main()  # pylint: disable=no-value-for-parameter
+# Renderer processes import the main module, do not run the service again there.
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
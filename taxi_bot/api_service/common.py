@@ -1,17 +1,30 @@
 """Common methods."""
 
 import functools
+import json
 import logging
+import mimetypes
+import os
 
-from flask import jsonify, send_from_directory
+from flask import Response, jsonify, request, send_from_directory
 from marshmallow import fields
 from sqlalchemy import exc
 from webargs import flaskparser, validate
 
+from taxi_bot.api_service import query
+from taxi_bot.api_service.geometry import Route
+from taxi_bot.api_service.janitor import image_key, image_path, is_image_name
+from taxi_bot.api_service.route import route_client
 from taxi_bot.api_service.schema import app
 
 logger = logging.getLogger(__name__)
 
+# Maximum time to wait for a route image rendered in background, seconds.
+IMAGE_WAIT_TIMEOUT = 10
+
+# Image names are hashes of the image content, images never change.
+IMAGE_MAX_AGE = 365 * 24 * 3600
+
 use_body = functools.partial(flaskparser.use_args, location="json", error_status_code=400)
 
 LocationField = {
@@ -32,6 +45,34 @@ def calculate_price(distance):
     return round(distance)
 
 
+def get_order_ride(order):
+    """Get order ride route and summary.
+
+    The ride route does not depend on the driver, so it is built once and saved with the order.
+
+    :param OrderTable order: order
+    :return (Route, dict(duration, distance, price)): ride route
+        and summary or None on ORS error
+    """
+    if order.ride_polyline:
+        return Route.decode(order.ride_polyline), json.loads(order.ride_summary)
+    ors_result = route_client.get_ors_route(
+        order.start_latitude,
+        order.start_longitude,
+        order.finish_latitude,
+        order.finish_longitude,
+    )
+    # Skip if received ORS error.
+    if not ors_result:
+        return None
+    ride_route, ride_summary = ors_result
+    ride_summary["price"] = calculate_price(ride_summary["distance"])
+    query.update_order_ride_by_order_id(
+        order.order_id, json.dumps(ride_summary), ride_route.polyline
+    )
+    return ride_route, ride_summary
+
+
 def resp(status=200, data=None):
     """Return response for http status."""
     logger.debug("response: status=%s, data=%s", status, data)
@@ -56,5 +97,74 @@ def storage_error(error):
 
 @app.route("/images/<filename>")
 def download_file(filename):
-    """Download file."""
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+    """Download file.
+
+    Waits for the image if it is still rendering. Recently downloaded images are served from
+    memory, with IMAGE_ACCEL_REDIRECT config the file is sent by the front web server.
+    """
+    if not is_image_name(filename):
+        return not_found("Image not found")
+    if not route_client.render_queue.wait(image_key(filename), IMAGE_WAIT_TIMEOUT):
+        response, status = resp(503, {"detail": "Image is not ready"})
+        response.headers["Retry-After"] = "1"
+        return response, status
+    etag = os.path.splitext(filename)[0]
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    cached = route_client.image_cache.get(filename)
+    accel_redirect = app.config.get("IMAGE_ACCEL_REDIRECT")
+    if cached is None and (accel_redirect or route_client.image_cache.maxsize > 0):
+        path = image_path(app.config["UPLOAD_FOLDER"], filename)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return not_found("Image not found")
+        if accel_redirect:
+            # nginx sends the file from an internal location, see README.
+            response = Response(mimetype=mimetype)
+            response.headers["X-Accel-Redirect"] = f"{accel_redirect}/{filename[:2]}/{filename}"
+            return _image_response(response, etag, mtime)
+        with open(path, "rb") as f:
+            cached = (f.read(), mtime)
+        route_client.image_cache.put(filename, cached)
+    if cached is not None:
+        data, mtime = cached
+        return _image_response(Response(data, mimetype=mimetype), etag, mtime)
+    response = send_from_directory(
+        os.path.dirname(image_path(app.config["UPLOAD_FOLDER"], filename)),
+        filename,
+        etag=etag,
+        max_age=IMAGE_MAX_AGE,
+    )
+    response.cache_control.immutable = True
+    return response
+
+
+def _image_response(response, etag, mtime):
+    """Add caching headers to image response.
+
+    :param flask.Response response: image response
+    :param str etag: image ETag
+    :param float mtime: image modification time
+    :return flask.Response: response or 304 (not modified) response
+    """
+    response.set_etag(etag)
+    response.last_modified = mtime
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+@app.route("/tiles/<int:zoom>/<int:x>/<int:y>.png")
+def download_tile(zoom, x, y):
+    """Download map tile from the local tile cache.
+
+    Route images rendered with plotly load the base map from here. Only cached tiles are served,
+    the tiles of an image are downloaded before it is rendered, so the service does not proxy
+    arbitrary tiles from the tile server.
+    """
+    tile_cache = route_client.tile_cache
+    tile = tile_cache.get(zoom, x, y, download=False) if tile_cache else None
+    if not tile:
+        return not_found("Tile not found")
+    return Response(tile, mimetype="image/png")
@@ -5,17 +5,18 @@ import json
 from webargs import fields
 from werkzeug.routing import BaseConverter, ValidationError
 
-from taxi_bot.api_service import query
+from taxi_bot.api_service import outbox, query
 from taxi_bot.api_service.common import (
     LocationField,
-    calculate_price,
     conflict,
+    get_order_ride,
     not_found,
     resp,
     use_body,
 )
+from taxi_bot.api_service.geo_index import driver_index
+from taxi_bot.api_service.outbox import outbox_dispatcher
 from taxi_bot.api_service.route import route_client
-from taxi_bot.api_service.rpc import rpc_client
 from taxi_bot.api_service.schema import (
     CANCELED_ORDER_STATE,
     CANCELED_REQUEST_STATE,
@@ -117,52 +118,58 @@ def post_order(body, customer_id):
         return conflict("Order race condition")
     if order.driver_id:
         return conflict("Order exists")
-    driver_requests = query.find_all_driver_requests()
-    for driver_request in driver_requests:
-        # Use task queue for long procedures, for example Celery
-        # See https://docs.celeryq.dev/en/stable/
-        # But necessary not in_memory db for work with other os processes
-        ors_result = route_client.get_ors_route(
-            driver_request.latitude,
-            driver_request.longitude,
-            body["start_location"]["latitude"],
-            body["start_location"]["longitude"],
-        )
+    ride = None
+    start_location = (body["start_location"]["latitude"], body["start_location"]["longitude"])
+    driver_ids = driver_index.find_nearby(*start_location)
+    driver_requests = query.find_driver_requests_by_driver_ids(driver_ids)
+    # Both routing phases together wait at most route_deadline.
+    deadline = route_client.deadline()
+    to_customer_summaries = route_client.get_ors_distances(
+        [(r.latitude, r.longitude) for r in driver_requests], [start_location], deadline
+    )
+    # Skip if received ORS error or customer is out of driver radius.
+    driver_requests = [
+        r
+        for r, summary in zip(driver_requests, to_customer_summaries)
+        if summary and summary["distance"] < r.radius
+    ]
+    # Use task queue for long procedures, for example Celery
+    # See https://docs.celeryq.dev/en/stable/
+    # But necessary not in_memory db for work with other os processes
+    to_customer_routes = route_client.get_ors_routes(
+        [(r.latitude, r.longitude, *start_location) for r in driver_requests], deadline
+    )
+    for driver_request, ors_result in zip(driver_requests, to_customer_routes):
         # Skip if received ORS error.
         if not ors_result:
             continue
         to_customer_route, to_customer_summary = ors_result
-        if to_customer_summary.get("distance", 0) < driver_request.radius:
-            ors_result = route_client.get_ors_route(
-                body["start_location"]["latitude"],
-                body["start_location"]["longitude"],
-                body["finish_location"]["latitude"],
-                body["finish_location"]["longitude"],
-            )
-            # Skip if received ORS error.
-            if ors_result:
-                ride_route, ride_summary = ors_result
-                image_url = route_client.create_route_image(to_customer_route, ride_route)
-                distance = ride_summary["distance"]
-                ride_summary["price"] = calculate_price(distance)
-                params = {
-                    "order_id": order.order_id,
-                    "start_latitude": body["start_location"]["latitude"],
-                    "start_longitude": body["start_location"]["longitude"],
-                    "finish_latitude": body["finish_location"]["latitude"],
-                    "finish_longitude": body["finish_location"]["longitude"],
-                    "ride_summary": ride_summary,
-                    "to_customer_summary": to_customer_summary,
-                    "image_url": image_url,
-                }
-                rpc_client.notify_driver(driver_request.messenger_id, "customer_found", params)
-                query.update_driver_request_summary(
-                    driver_request.driver_request_id,
-                    json.dumps(ride_summary),
-                    json.dumps(to_customer_summary),
-                    image_url,
-                )
+        # The ride route does not depend on the driver, build it once for the first offer.
+        ride = ride or get_order_ride(order)
+        # Skip if received ORS error.
+        if not ride:
+            continue
+        ride_route, ride_summary = ride
+        image_url = route_client.create_route_image(to_customer_route, ride_route)
+        params = {
+            "order_id": order.order_id,
+            "start_latitude": body["start_location"]["latitude"],
+            "start_longitude": body["start_location"]["longitude"],
+            "finish_latitude": body["finish_location"]["latitude"],
+            "finish_longitude": body["finish_location"]["longitude"],
+            "ride_summary": ride_summary,
+            "to_customer_summary": to_customer_summary,
+            "image_url": route_client.channel_image_url(image_url, "telegram"),
+        }
+        outbox.notify_driver(driver_request.messenger_id, "customer_found", params)
+        query.update_driver_request_summary(
+            driver_request.driver_request_id,
+            json.dumps(ride_summary),
+            json.dumps(to_customer_summary),
+            image_url,
+        )
     db.session.commit()
+    outbox_dispatcher.wake()
     return resp(data={"order_id": order.order_id})
 
 
@@ -189,10 +196,11 @@ def customer_cancel(body, customer_id):
             current_state=CONFIRMED_REQUEST_STATE,
             new_state=CANCELED_REQUEST_STATE,
         )
-        rpc_client.notify_driver(
+        outbox.notify_driver(
             order.driver_messenger_id,
             "customer_canceled",
             params={"order_id": order.order_id},
         )
     db.session.commit()
+    outbox_dispatcher.wake()
     return resp()
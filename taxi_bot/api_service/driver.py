@@ -1,19 +1,21 @@
 """Driver bot api."""
 import json
 
+from haversine import haversine
 from webargs import fields, validate
 
-from taxi_bot.api_service import query
+from taxi_bot.api_service import outbox, query
 from taxi_bot.api_service.common import (
     LocationField,
-    calculate_price,
     conflict,
+    get_order_ride,
     not_found,
     resp,
     use_body,
 )
-from taxi_bot.api_service.route import route_client
-from taxi_bot.api_service.rpc import rpc_client
+from taxi_bot.api_service.geo_index import driver_index
+from taxi_bot.api_service.outbox import outbox_dispatcher
+from taxi_bot.api_service.route import MATRIX_CHUNK_SIZE, route_client
 from taxi_bot.api_service.schema import (
     CANCELED_ORDER_STATE,
     CANCELED_REQUEST_STATE,
@@ -72,6 +74,58 @@ def get_driver(messenger_id):
     return resp(data=data)
 
 
+def _find_nearest_order(latitude, longitude, radius, orders):
+    """Find the order with the nearest start location by road.
+
+    The road distance is never shorter than the great-circle distance, so orders are checked
+    in order of great-circle distance by chunks of openrouteservice matrix requests and the search
+    stops as soon as the next order can not be closer than the best one found or is out of the
+    driver radius. The route geometry is requested for the nearest order only.
+
+    :param float latitude: Driver latitude
+    :param float longitude: Driver longitude
+    :param int radius: Driver radius, km
+    :param [OrderTable] orders: Active orders
+    :return (OrderTable, Route, dict(duration, distance)): nearest order, route
+        and summary to customer or None
+    """
+    candidates = sorted(
+        (
+            (haversine((latitude, longitude), (o.start_latitude, o.start_longitude)), o)
+            for o in orders
+        ),
+        key=lambda x: x[0],
+    )
+    nearest, nearest_distance = None, radius
+    deadline = route_client.deadline()
+    for i in range(0, len(candidates), MATRIX_CHUNK_SIZE):
+        chunk = candidates[i : i + MATRIX_CHUNK_SIZE]
+        if chunk[0][0] >= nearest_distance:
+            break
+        summaries = route_client.get_ors_distances(
+            [(latitude, longitude)],
+            [(o.start_latitude, o.start_longitude) for _, o in chunk],
+            deadline,
+        )
+        for (_, order), summary in zip(chunk, summaries):
+            # Skip if received ORS error.
+            if summary and summary["distance"] < nearest_distance:
+                nearest, nearest_distance = order, summary["distance"]
+    if not nearest:
+        return None
+    ors_result = route_client.get_ors_route(
+        latitude,
+        longitude,
+        nearest.start_latitude,
+        nearest.start_longitude,
+    )
+    # Skip if received ORS error.
+    if not ors_result:
+        return None
+    to_customer_route, to_customer_summary = ors_result
+    return nearest, to_customer_route, to_customer_summary
+
+
 @app.route("/driver/<int:driver_id>/request", methods=["POST"])
 @use_body(
     {
@@ -106,52 +160,36 @@ def post_driver_request(body, driver_id):
     # Use task queue for long procedures, for example Celery
     # See https://docs.celeryq.dev/en/stable/
     # But necessary not in_memory db for work with other os processes
-    orders_with_radius = []
-    for order in orders:
-        ors_result = route_client.get_ors_route(
-            body["location"]["latitude"],
-            body["location"]["longitude"],
-            order.start_latitude,
-            order.start_longitude,
-        )
+    nearest = _find_nearest_order(
+        body["location"]["latitude"], body["location"]["longitude"], body["radius"], orders
+    )
+    if nearest:
+        order, to_customer_route, to_customer_summary = nearest
+        ride = get_order_ride(order)
         # Skip if received ORS error.
-        if not ors_result:
-            continue
-        to_customer_route, to_customer_summary = ors_result
-        distance = to_customer_summary.get("distance", 0)
-        orders_with_radius.append((distance, order, to_customer_route, to_customer_summary))
-    orders_with_radius = sorted(orders_with_radius, key=lambda x: x[0])
-    if orders_with_radius:
-        radius, order, to_customer_route, to_customer_summary = orders_with_radius[0]
-        if radius < body["radius"]:
-            ors_result = route_client.get_ors_route(
-                order.start_latitude,
-                order.start_longitude,
-                order.finish_latitude,
-                order.finish_longitude,
+        if ride:
+            ride_route, ride_summary = ride
+            image_url = route_client.create_route_image(to_customer_route, ride_route)
+            data = {
+                "order_id": order.order_id,
+                "start_latitude": order.start_latitude,
+                "start_longitude": order.start_longitude,
+                "finish_latitude": order.finish_latitude,
+                "finish_longitude": order.finish_longitude,
+                "ride_summary": ride_summary,
+                "to_customer_summary": to_customer_summary,
+                "image_url": route_client.channel_image_url(image_url, "telegram"),
+            }
+            query.update_driver_request_summary(
+                driver_request.driver_request_id,
+                json.dumps(ride_summary),
+                json.dumps(to_customer_summary),
+                image_url,
             )
-            # Skip if received ORS error.
-            if ors_result:
-                ride_route, ride_summary = ors_result
-                ride_summary["price"] = calculate_price(ride_summary["distance"])
-                image_url = route_client.create_route_image(to_customer_route, ride_route)
-                data = {
-                    "order_id": order.order_id,
-                    "start_latitude": order.start_latitude,
-                    "start_longitude": order.start_longitude,
-                    "finish_latitude": order.finish_latitude,
-                    "finish_longitude": order.finish_longitude,
-                    "ride_summary": ride_summary,
-                    "to_customer_summary": to_customer_summary,
-                    "image_url": image_url,
-                }
-                query.update_driver_request_summary(
-                    driver_request.driver_request_id,
-                    json.dumps(ride_summary),
-                    json.dumps(to_customer_summary),
-                    image_url,
-                )
     db.session.commit()
+    driver_index.add(
+        driver_id, driver_request.latitude, driver_request.longitude, driver_request.radius
+    )
     return resp(data=data)
 
 
@@ -190,12 +228,14 @@ def confirm_order(body, driver_id):
         "order_id": order.order_id,
         "ride_summary": json.loads(driver_request.ride_summary),
         "to_customer_summary": json.loads(driver_request.to_customer_summary),
-        "image_url": driver_request.image_url,
+        "image_url": route_client.channel_image_url(driver_request.image_url, order.channel),
     }
     if driver_request.last_name:
         params["last_name"] = driver_request.last_name
-    rpc_client.notify_customer(order.channel, order.messenger_id, "driver_found", params)
+    outbox.notify_customer(order.channel, order.messenger_id, "driver_found", params)
     db.session.commit()
+    outbox_dispatcher.wake()
+    driver_index.remove(driver_id)
     return resp(data={"result": "success"})
 
 
@@ -243,8 +283,9 @@ def arrival(body, driver_id):
         return conflict("Order state error")
     query.update_order_state_by_order_id(order.order_id, DRIVER_ARRIVED_ORDER_STATE)
     params = {"order_id": order.order_id}
-    rpc_client.notify_customer(order.channel, order.messenger_id, "driver_arrived", params)
+    outbox.notify_customer(order.channel, order.messenger_id, "driver_arrived", params)
     db.session.commit()
+    outbox_dispatcher.wake()
     return resp()
 
 
@@ -266,8 +307,9 @@ def start_ride(body, driver_id):
         return conflict("Order state error")
     query.update_order_state_by_order_id(order.order_id, STARTED_RIDE_ORDER_STATE)
     params = {"order_id": order.order_id}
-    rpc_client.notify_customer(order.channel, order.messenger_id, "ride_started", params)
+    outbox.notify_customer(order.channel, order.messenger_id, "ride_started", params)
     db.session.commit()
+    outbox_dispatcher.wake()
     return resp()
 
 
@@ -294,8 +336,10 @@ def complete_ride(body, driver_id):
         new_state=COMPLETED_REQUEST_STATE,
     )
     params = {"order_id": order.order_id}
-    rpc_client.notify_customer(order.channel, order.messenger_id, "ride_completed", params)
+    outbox.notify_customer(order.channel, order.messenger_id, "ride_completed", params)
     db.session.commit()
+    outbox_dispatcher.wake()
+    driver_index.remove(driver_id)
     return resp()
 
 
@@ -326,7 +370,7 @@ def driver_cancel(body, driver_id):
         )
         query.update_order_state_by_order_id(order.order_id, CANCELED_ORDER_STATE)
         params = {"order_id": order.order_id}
-        rpc_client.notify_customer(order.channel, order.messenger_id, "driver_canceled", params)
+        outbox.notify_customer(order.channel, order.messenger_id, "driver_canceled", params)
     elif driver_request.state == INIT_REQUEST_STATE:
         query.update_driver_request_state_by_driver_id(
             driver_id,
@@ -334,4 +378,6 @@ def driver_cancel(body, driver_id):
             new_state=CANCELED_REQUEST_STATE,
         )
     db.session.commit()
+    outbox_dispatcher.wake()
+    driver_index.remove(driver_id)
     return resp()
@@ -0,0 +1,143 @@
+"""In-process spatial index of active driver requests."""
+import logging
+import math
+import threading
+
+from haversine import haversine
+
+logger = logging.getLogger(__name__)
+
+# Length of one latitude degree in kilometers.
+_KM_PER_DEGREE = 111.2
+
+
+class _DriverIndex:
+    """Fixed-cell lat/lon grid of drivers waiting for an order.
+
+    Every driver is stored in the cell containing the driver's location.
+    A lookup scans only the cells that may contain drivers whose radius covers
+    the pickup point, so the cost depends on the local driver density
+    instead of the fleet size.
+
+    The index is a pre-filter for the database: callers must still check
+    the state of returned driver requests.
+    """
+
+    def __init__(self, cell_size=0.1):
+        """Create empty index.
+
+        :param float cell_size: Grid cell size in degrees
+        """
+        self.cell_size = cell_size
+        self._lock = threading.Lock()
+        self._drivers = {}
+        self._cells = {}
+
+    def _cell(self, latitude, longitude):
+        return (
+            math.floor(latitude / self.cell_size),
+            math.floor(longitude / self.cell_size),
+        )
+
+    def _window(self, latitude, longitude, radius):
+        """Get cell ranges of the bounding box around point.
+
+        :param float latitude: Point latitude
+        :param float longitude: Point longitude
+        :param float radius: Bounding box half size in kilometers
+        :return (range, range): latitude and longitude cell index ranges
+        """
+        delta_lat = radius / _KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(min(abs(latitude) + delta_lat, 89.9)))
+        delta_lon = min(radius / (_KM_PER_DEGREE * cos_lat), 180)
+        min_lat, min_lon = self._cell(latitude - delta_lat, longitude - delta_lon)
+        max_lat, max_lon = self._cell(latitude + delta_lat, longitude + delta_lon)
+        return range(min_lat, max_lat + 1), range(min_lon, max_lon + 1)
+
+    def _remove(self, driver_id):
+        entry = self._drivers.pop(driver_id, None)
+        if entry:
+            cell = self._cell(entry[0], entry[1])
+            self._cells[cell].discard(driver_id)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+    def clear(self):
+        """Remove all drivers from index."""
+        with self._lock:
+            self._drivers.clear()
+            self._cells.clear()
+
+    def load(self, driver_requests):
+        """Replace index content.
+
+        :param [DriverRequestTable] driver_requests: Driver requests with state=INIT_REQUEST_STATE
+        """
+        with self._lock:
+            self._drivers.clear()
+            self._cells.clear()
+            for r in driver_requests:
+                self._drivers[r.driver_id] = (r.latitude, r.longitude, r.radius)
+                self._cells.setdefault(self._cell(r.latitude, r.longitude), set()).add(r.driver_id)
+        logger.debug("driver index loaded: drivers=%s", len(self._drivers))
+
+    def add(self, driver_id, latitude, longitude, radius):
+        """Add (or move) driver.
+
+        :param int driver_id: db.driver.driver_id
+        :param float latitude: Driver latitude
+        :param float longitude: Driver longitude
+        :param int radius: Radius in which the driver takes orders, km
+        """
+        with self._lock:
+            self._remove(driver_id)
+            self._drivers[driver_id] = (latitude, longitude, radius)
+            self._cells.setdefault(self._cell(latitude, longitude), set()).add(driver_id)
+
+    def remove(self, driver_id):
+        """Remove driver if exists.
+
+        :param int driver_id: db.driver.driver_id
+        """
+        with self._lock:
+            self._remove(driver_id)
+
+    def find_nearby(self, latitude, longitude):
+        """Find drivers whose radius covers the point.
+
+        Great-circle distance is a lower bound of the road distance,
+        so no driver able to reach the point within the driver's radius is missed.
+
+        :param float latitude: Point latitude
+        :param float longitude: Point longitude
+        :return [int]: db.driver.driver_id list
+        """
+        with self._lock:
+            if not self._drivers:
+                return []
+            max_radius = max(radius for _, _, radius in self._drivers.values())
+            lat_range, lon_range = self._window(latitude, longitude, max_radius)
+            if len(lat_range) * len(lon_range) > len(self._cells):
+                cells = [
+                    ids
+                    for (lat, lon), ids in self._cells.items()
+                    if lat in lat_range and lon in lon_range
+                ]
+            else:
+                cells = [
+                    self._cells[(lat, lon)]
+                    for lat in lat_range
+                    for lon in lon_range
+                    if (lat, lon) in self._cells
+                ]
+            result = []
+            for ids in cells:
+                for driver_id in ids:
+                    driver_lat, driver_lon, radius = self._drivers[driver_id]
+                    if haversine((driver_lat, driver_lon), (latitude, longitude)) < radius:
+                        result.append(driver_id)
+        logger.debug("driver index: found=%s total=%s", len(result), len(self._drivers))
+        return sorted(result)
+
+
+driver_index = _DriverIndex()
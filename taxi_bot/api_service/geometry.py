@@ -0,0 +1,102 @@
+"""Route geometry."""
+from array import array
+
+
+class Route:
+    """Read-only route line with coordinates in compact double arrays.
+
+    Routes are shared by caches and callers, so coordinates are exposed as read-only
+    memoryviews and attributes can not be set after the route is created.
+    The bounding box is computed once when the route is created.
+    """
+
+    __slots__ = ("lon", "lat", "polyline", "min_lat", "max_lat", "min_lon", "max_lon")
+
+    def __init__(self, lon, lat, polyline=None):
+        """Create route.
+
+        :param iterable lon: longitudes, an array("d") is used without copying
+        :param iterable lat: latitudes, an array("d") is used without copying
+        :param str polyline: Encoded polyline of the coordinates, encoded from them if omitted
+        """
+        lon = lon if isinstance(lon, array) else array("d", lon)
+        lat = lat if isinstance(lat, array) else array("d", lat)
+        if polyline is None:
+            polyline = encode_polyline(zip(lon, lat))
+        init = super().__setattr__
+        init("lon", memoryview(lon).toreadonly())
+        init("lat", memoryview(lat).toreadonly())
+        init("polyline", polyline)
+        init("min_lat", min(lat, default=None))
+        init("max_lat", max(lat, default=None))
+        init("min_lon", min(lon, default=None))
+        init("max_lon", max(lon, default=None))
+
+    @classmethod
+    def decode(cls, polyline):
+        """Decode route geometry.
+
+        :param str polyline: Encoded polyline, see https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+        :return Route: route
+        """
+        lon, lat = array("d"), array("d")
+        value = shift = latitude = longitude = 0
+        is_longitude = False
+        for byte in polyline.encode():
+            byte -= 63
+            value |= (byte & 0x1F) << shift
+            if byte >= 0x20:
+                shift += 5
+                continue
+            delta = ~(value >> 1) if value & 1 else value >> 1
+            if is_longitude:
+                longitude += delta
+                lat.append(latitude / 1e5)
+                lon.append(longitude / 1e5)
+            else:
+                latitude += delta
+            is_longitude = not is_longitude
+            value = shift = 0
+        return cls(lon, lat, polyline)
+
+    def __setattr__(self, name, value):
+        """Forbid changes of shared routes."""
+        raise AttributeError(f"Route is read-only, can not set {name!r}")
+
+    def __delattr__(self, name):
+        """Forbid changes of shared routes."""
+        raise AttributeError(f"Route is read-only, can not delete {name!r}")
+
+    def __len__(self):
+        """Get number of points."""
+        return len(self.lat)
+
+    def __eq__(self, other):
+        """Compare route coordinates."""
+        if not isinstance(other, Route):
+            return NotImplemented
+        return self.lon == other.lon and self.lat == other.lat
+
+    def __repr__(self):
+        """Get short route description."""
+        return f"Route(points={len(self)}, polyline={self.polyline[:20]!r})"
+
+
+def encode_polyline(coordinates):
+    """Encode coordinates, see Route.decode.
+
+    :param [(float, float)] coordinates: (longitude, latitude) list
+    :return str: encoded polyline
+    """
+    result = []
+    prev_lat = prev_lon = 0
+    for lon, lat in coordinates:
+        lat, lon = round(lat * 1e5), round(lon * 1e5)
+        for value in (lat - prev_lat, lon - prev_lon):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        prev_lat, prev_lon = lat, lon
+    return "".join(result)
@@ -0,0 +1,129 @@
+"""Route image storage cleanup."""
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# sha256 hex digest, optional channel variant and extension, see route._image_name.
+IMAGE_NAME_RE = re.compile(r"[0-9a-f]{64}(\.[a-z]+)?\.[a-z]+")
+
+
+def is_image_name(name):
+    """Check that the name is a route image name, so it is safe to use in a path.
+
+    :param str name: Image or image variant name from a request
+    :return bool: True for a valid name
+    """
+    return IMAGE_NAME_RE.fullmatch(name) is not None
+
+
+def image_path(directory, name):
+    """Get route image path.
+
+    Images are sharded into subdirectories by the first two characters of the name (content
+    hash), so each subdirectory keeps about 1/256 of the images.
+
+    :param str directory: Image storage directory
+    :param str name: Image name
+    :return str: path
+    """
+    return os.path.join(directory, name[:2], name)
+
+
+def image_key(name):
+    """Get route image key shared by the image and its variants.
+
+    :param str name: Image or image variant name
+    :return str: key
+    """
+    return name.split(".", 1)[0]
+
+
+class ImageJanitor:
+    """Background removal of old route images.
+
+    Images of active driver requests (with variants) are kept, other images are removed after `retention`
+    seconds, and the oldest of them are removed earlier when the images exceed `max_bytes`.
+    """
+
+    def __init__(self):
+        """Create stopped janitor."""
+        self.directory = None
+        self.retention = None
+        self.max_bytes = None
+        self.removed = 0
+        self._active_images = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(
+        self, directory, active_images, retention=86400, max_bytes=1_000_000_000, interval=600
+    ):
+        """Start cleanup thread.
+
+        :param str directory: Image storage directory
+        :param callable active_images: Function returning names of images in use
+        :param float retention: Image retention after it is not used, seconds
+        :param int max_bytes: Maximum size of images, bytes, 0 disables the limit
+        :param float interval: Cleanup interval, seconds
+        """
+        self.directory = directory
+        self.retention = retention
+        self.max_bytes = max_bytes
+        self._active_images = active_images
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="image-janitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop cleanup thread."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def clean(self):
+        """Remove old images once.
+
+        :return int: number of removed images
+        """
+        active = {image_key(name) for name in self._active_images()}
+        images, total = [], 0
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir() or len(shard.name) != 2:
+                continue
+            for entry in os.scandir(shard.path):
+                stat = entry.stat()
+                total += stat.st_size
+                if image_key(entry.name) not in active:
+                    images.append((stat.st_mtime, stat.st_size, entry.path))
+        images.sort()
+        expired = time.time() - self.retention
+        removed = 0
+        for mtime, size, path in images:
+            if mtime >= expired and (not self.max_bytes or total <= self.max_bytes):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            removed += 1
+        self.removed += removed
+        logger.info("image janitor: removed=%s size=%s active=%s", removed, total, len(active))
+        return removed
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.clean()
+            except Exception:
+                logger.exception("image cleanup failed")
+
+
+image_janitor = ImageJanitor()
@@ -0,0 +1,473 @@
+"""Offline routing on a road graph loaded from an OpenStreetMap extract."""
+import collections
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import xml.etree.ElementTree as ET  # nosec B405: the extract is a local file set by the operator
+
+from haversine import Unit, haversine
+from openrouteservice import exceptions
+
+from taxi_bot.api_service.geometry import encode_polyline
+
+logger = logging.getLogger(__name__)
+
+# Default speed by highway type, km/h.
+_HIGHWAY_SPEEDS = {
+    "motorway": 100,
+    "motorway_link": 60,
+    "trunk": 80,
+    "trunk_link": 50,
+    "primary": 60,
+    "primary_link": 40,
+    "secondary": 50,
+    "secondary_link": 40,
+    "tertiary": 40,
+    "tertiary_link": 30,
+    "unclassified": 30,
+    "residential": 30,
+    "living_street": 10,
+    "service": 15,
+}
+
+# Number of settled nodes after which the witness search gives up and adds a shortcut.
+_WITNESS_SETTLE_LIMIT = 50
+
+# Saved contracted graph file suffix and format version.
+_GRAPH_SUFFIX = ".ch.json"
+_GRAPH_VERSION = 1
+
+# Snapping grid cell size, degrees.
+_CELL_SIZE = 0.01
+
+# Maximum number of snapping grid rings to search around a location (about 10 km).
+_MAX_SNAP_RINGS = 100
+
+
+def _speed(tags):
+    """Get way speed.
+
+    :param dict tags: OSM way tags
+    :return float: speed km/h or None if way is not for cars
+    """
+    speed = _HIGHWAY_SPEEDS.get(tags.get("highway"))
+    if not speed or tags.get("access") in ("no", "private"):
+        return None
+    match = re.match(r"\s*(\d+(?:\.\d+)?)\s*(mph)?", tags.get("maxspeed", ""))
+    if match:
+        speed = float(match.group(1)) * (1.609 if match.group(2) else 1)
+    return speed or None
+
+
+def _oneway(tags):
+    """Get way direction.
+
+    :param dict tags: OSM way tags
+    :return int: 1 - forward only, -1 - backward only, 0 - both directions
+    """
+    oneway = tags.get("oneway")
+    if oneway in ("yes", "true", "1"):
+        return 1
+    if oneway == "-1":
+        return -1
+    if oneway is None and (
+        tags.get("junction") == "roundabout" or tags.get("highway") == "motorway"
+    ):
+        return 1
+    return 0
+
+
+def _parse_osm(path):
+    """Read car roads from OSM XML extract.
+
+    :param str path: .osm file path
+    :return (dict, list): {node_id: (lat, lon)} and [([node_id], speed, oneway)]
+    """
+    nodes, ways = {}, []
+    for _, elem in ET.iterparse(path):  # nosec B314
+        if elem.tag == "node":
+            nodes[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+            speed = _speed(tags)
+            if speed:
+                refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                ways.append((refs, speed, _oneway(tags)))
+            elem.clear()
+    return nodes, ways
+
+
+def _source_stamp(path):
+    """Get extract modification stamp, the saved graph is rebuilt when it changes."""
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class LocalRoutingClient:
+    """Car routing on a local road graph without network requests.
+
+    Implements `directions` and `distance_matrix` methods of `openrouteservice.Client`
+    used by `_RouteClient`, so it can be used as a drop-in routing backend.
+
+    The graph is built from an OpenStreetMap XML extract (.osm). Only junctions and way ends
+    are graph nodes, chains of shape points between them become single edges keeping their
+    geometry. The graph is preprocessed with contraction hierarchies: nodes are contracted
+    one by one in order of importance and shortcut edges preserve shortest paths. A query is
+    a bidirectional Dijkstra search on edges leading to more important nodes, which settles
+    only a few hundred nodes even on large graphs.
+
+    The preprocessed graph is saved next to the extract as `<osm_path>.ch.json` and loaded
+    on the next start while the extract is not modified.
+    """
+
+    def __init__(self, osm_path):
+        """Load and preprocess road graph.
+
+        :param str osm_path: OpenStreetMap XML extract path
+        """
+        self.coords = []
+        # Edge data is (duration, distance, middle node of shortcut or -1).
+        self._out = []
+        self._in = []
+        # Shape points of original edges between graph nodes, {(u, v): [(lat, lon)]}.
+        self._geometry = {}
+        # Snapping grid, {cell: [(lat, lon, node)]}.
+        self._cells = {}
+        cache_path = f"{osm_path}{_GRAPH_SUFFIX}"
+        source = _source_stamp(osm_path)
+        if not self._load(cache_path, source):
+            self._build(*_parse_osm(osm_path))
+            self._contract()
+            self._save(cache_path, source)
+        logger.info("local routing: osm=%s nodes=%s", osm_path, len(self.coords))
+
+    def _build(self, nodes, ways):
+        index, snap_points = {}, []
+
+        def node(osm_id):
+            if osm_id not in index:
+                index[osm_id] = len(self.coords)
+                self.coords.append(nodes[osm_id])
+                self._out.append({})
+                self._in.append({})
+            return index[osm_id]
+
+        ways = [([r for r in refs if r in nodes], speed, oneway) for refs, speed, oneway in ways]
+        uses = collections.Counter(r for refs, _, _ in ways for r in refs)
+        for refs, speed, oneway in ways:
+            if len(refs) < 2:
+                continue
+            u, points, distance = node(refs[0]), [], 0
+            for previous, ref in zip(refs, refs[1:]):
+                distance += haversine(nodes[previous], nodes[ref], unit=Unit.METERS)
+                if ref != refs[-1] and uses[ref] == 1:
+                    # Shape point of the way, not a junction.
+                    points.append((distance, nodes[ref]))
+                    continue
+                v = node(ref)
+                duration = distance / (speed / 3.6)
+                shape = [point for _, point in points]
+                if oneway >= 0:
+                    self._add_edge(u, v, duration, distance, -1, shape)
+                if oneway <= 0:
+                    self._add_edge(v, u, duration, distance, -1, shape[::-1])
+                # Shape points snap to the closer end of the chain.
+                snap_points.extend(
+                    (*point, u if offset * 2 <= distance else v) for offset, point in points
+                )
+                u, points, distance = v, [], 0
+        snap_points.extend((lat, lon, v) for v, (lat, lon) in enumerate(self.coords))
+        self._index_snap_points(snap_points)
+
+    def _index_snap_points(self, snap_points):
+        for lat, lon, v in snap_points:
+            self._cells.setdefault(self._cell(lat, lon), []).append((lat, lon, v))
+
+    def _add_edge(self, u, v, duration, distance, middle, shape=None):
+        if u == v:
+            return
+        current = self._out[u].get(v)
+        if current is None or duration < current[0]:
+            self._out[u][v] = self._in[v][u] = (duration, distance, middle)
+            if shape:
+                self._geometry[(u, v)] = shape
+            else:
+                self._geometry.pop((u, v), None)
+
+    @staticmethod
+    def _witness(source, excluded, targets, limit, out):
+        """Find shortest distances from source avoiding excluded node.
+
+        :return dict: {node: duration}, upper bounds for not settled nodes
+        """
+        durations = {source: 0}
+        heap = [(0, source)]
+        settled, targets = 0, set(targets)
+        while heap and targets and settled < _WITNESS_SETTLE_LIMIT:
+            duration, u = heapq.heappop(heap)
+            if duration > limit:
+                break
+            if duration > durations[u]:
+                continue
+            settled += 1
+            targets.discard(u)
+            for v, edge_duration in out[u].items():
+                candidate = duration + edge_duration
+                # Paths longer than the limit can not be witnesses.
+                if candidate <= limit and v != excluded and candidate < durations.get(v, math.inf):
+                    durations[v] = candidate
+                    heapq.heappush(heap, (candidate, v))
+        return durations
+
+    def _shortcuts(self, v, active_in, active_out):
+        """Get shortcuts required to contract node.
+
+        :return [(int, int, float, float)]: (from, to, duration, distance) list
+        """
+        ins, outs = active_in[v], active_out[v]
+        if not ins or not outs:
+            return []
+        max_out = max(outs.values())
+        result = []
+        for u, in_duration in ins.items():
+            durations = self._witness(u, v, outs, in_duration + max_out, active_out)
+            for w, out_duration in outs.items():
+                duration = in_duration + out_duration
+                if w != u and durations.get(w, math.inf) > duration:
+                    distance = self._out[u][v][1] + self._out[v][w][1]
+                    result.append((u, w, duration, distance))
+        return result
+
+    def _priority(self, v, active_in, active_out, deleted):
+        """Get node contraction priority, lower is contracted earlier.
+
+        :return (int, list): priority and shortcuts required to contract node now
+        """
+        shortcuts = self._shortcuts(v, active_in, active_out)
+        priority = len(shortcuts) - len(active_in[v]) - len(active_out[v]) + deleted[v]
+        return priority, shortcuts
+
+    def _contract(self):
+        count = len(self.coords)
+        # Durations of edges between nodes which are not contracted yet.
+        active_out = [{w: data[0] for w, data in edges.items()} for edges in self._out]
+        active_in = [{u: data[0] for u, data in edges.items()} for edges in self._in]
+        deleted, rank = [0] * count, [0] * count
+        heap = [(self._priority(v, active_in, active_out, deleted)[0], v) for v in range(count)]
+        heapq.heapify(heap)
+        next_rank = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            # Lazy update: priority may have grown since node was pushed.
+            priority, shortcuts = self._priority(v, active_in, active_out, deleted)
+            if heap and priority > heap[0][0]:
+                heapq.heappush(heap, (priority, v))
+                continue
+            for u, w, duration, distance in shortcuts:
+                self._add_edge(u, w, duration, distance, v)
+                if duration < active_out[u].get(w, math.inf):
+                    active_out[u][w] = active_in[w][u] = duration
+            for u in active_in[v]:
+                del active_out[u][v]
+                deleted[u] += 1
+            for w in active_out[v]:
+                del active_in[w][v]
+                deleted[w] += 1
+            active_in[v], active_out[v] = {}, {}
+            rank[v] = next_rank
+            next_rank += 1
+        self._set_hierarchy(
+            rank,
+            [
+                {w: data for w, data in self._out[u].items() if rank[w] > rank[u]}
+                for u in range(count)
+            ],
+            [
+                {w: data for w, data in self._in[u].items() if rank[w] > rank[u]}
+                for u in range(count)
+            ],
+        )
+
+    def _set_hierarchy(self, rank, up, down):
+        """Set contracted graph, the build adjacency is not needed anymore.
+
+        :param [int] rank: node contraction order
+        :param [dict] up: {to: edge data} of edges to more important nodes
+        :param [dict] down: {from: edge data} of edges from more important nodes
+        """
+        self._rank, self._up, self._down = rank, up, down
+        self._out = self._in = None
+
+    def _save(self, path, source):
+        data = {
+            "version": _GRAPH_VERSION,
+            "source": source,
+            "coords": self.coords,
+            "rank": self._rank,
+            "up": [[(w, *edge) for w, edge in edges.items()] for edges in self._up],
+            "down": [[(u, *edge) for u, edge in edges.items()] for edges in self._down],
+            "geometry": [(u, v, shape) for (u, v), shape in self._geometry.items()],
+            "snap": [point for points in self._cells.values() for point in points],
+        }
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning("local routing graph is not saved: path=%s error=%s", path, e)
+
+    def _load(self, path, source):
+        """Load contracted graph saved for the same extract.
+
+        :return bool: False if there is no valid saved graph
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != _GRAPH_VERSION or data.get("source") != source:
+            return False
+        self.coords = [tuple(c) for c in data["coords"]]
+        self._set_hierarchy(
+            data["rank"],
+            [{w: tuple(edge) for w, *edge in edges} for edges in data["up"]],
+            [{u: tuple(edge) for u, *edge in edges} for edges in data["down"]],
+        )
+        self._geometry = {(u, v): [tuple(p) for p in shape] for u, v, shape in data["geometry"]}
+        self._index_snap_points(data["snap"])
+        logger.info("local routing graph loaded: path=%s", path)
+        return True
+
+    @staticmethod
+    def _upward_search(source, edges):
+        """Dijkstra search on edges to more important nodes.
+
+        :return dict: {node: (duration, distance, parent)}
+        """
+        result = {source: (0, 0, -1)}
+        heap = [(0, source)]
+        while heap:
+            duration, u = heapq.heappop(heap)
+            if duration > result[u][0]:
+                continue
+            for v, (edge_duration, edge_distance, _) in edges[u].items():
+                if duration + edge_duration < result.get(v, (math.inf,))[0]:
+                    result[v] = (duration + edge_duration, result[u][1] + edge_distance, u)
+                    heapq.heappush(heap, (duration + edge_duration, v))
+        return result
+
+    @staticmethod
+    def _meet(forward, backward):
+        """Get the node of the shortest path where forward and backward searches meet."""
+        common = forward.keys() & backward.keys()
+        if not common:
+            return None
+        return min(common, key=lambda v: forward[v][0] + backward[v][0])
+
+    def _unpack(self, u, w, path):
+        """Append (lat, lon) points of edge (u, w) except u to path."""
+        stack = [(u, w)]
+        while stack:
+            a, b = stack.pop()
+            if self._rank[a] < self._rank[b]:
+                middle = self._up[a][b][2]
+            else:
+                middle = self._down[b][a][2]
+            if middle < 0:
+                path.extend(self._geometry.get((a, b), ()))
+                path.append(self.coords[b])
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / _CELL_SIZE), math.floor(lon / _CELL_SIZE)
+
+    def _snap(self, lon, lat):
+        """Get the graph node of the nearest road point.
+
+        :raise openrouteservice.exceptions.ApiError: no road near location
+        """
+        cell_lat, cell_lon = self._cell(lat, lon)
+        candidates, last_ring, ring = [], _MAX_SNAP_RINGS, 0
+        while ring <= last_ring:
+            candidates.extend(
+                point
+                for i in range(cell_lat - ring, cell_lat + ring + 1)
+                for j in range(cell_lon - ring, cell_lon + ring + 1)
+                if max(abs(i - cell_lat), abs(j - cell_lon)) == ring
+                for point in self._cells.get((i, j), ())
+            )
+            if candidates and last_ring == _MAX_SNAP_RINGS:
+                # Nodes of the next rings may be closer than nodes in the corners of this ring.
+                last_ring = math.ceil(ring * 1.5) + 1
+            ring += 1
+        if not candidates:
+            raise exceptions.ApiError(404, {"error": f"No road near {lon},{lat}"})
+        return min(candidates, key=lambda p: haversine((lat, lon), p[:2]))[2]
+
+    def directions(self, coordinates, profile="driving-car", **kwargs):
+        """Get route, see openrouteservice.Client.directions.
+
+        :param ((float, float), (float, float)) coordinates: (longitude, latitude) start and finish
+        :param str profile: only driving-car is supported
+        :return dict: openrouteservice response with encoded geometry and summary
+        :raise openrouteservice.exceptions.ApiError: route not found
+        """
+        source, target = self._snap(*coordinates[0]), self._snap(*coordinates[-1])
+        forward = self._upward_search(source, self._up)
+        backward = self._upward_search(target, self._down)
+        meet = self._meet(forward, backward)
+        if meet is None:
+            raise exceptions.ApiError(404, {"error": "Route not found"})
+        chain = [meet]
+        while forward[chain[0]][2] >= 0:
+            chain.insert(0, forward[chain[0]][2])
+        while backward[chain[-1]][2] >= 0:
+            chain.append(backward[chain[-1]][2])
+        path = [self.coords[source]]
+        for u, w in zip(chain, chain[1:]):
+            self._unpack(u, w, path)
+        return {
+            "routes": [
+                {
+                    "summary": {
+                        "duration": forward[meet][0] + backward[meet][0],
+                        "distance": forward[meet][1] + backward[meet][1],
+                    },
+                    "geometry": encode_polyline((lon, lat) for lat, lon in path),
+                }
+            ]
+        }
+
+    def distance_matrix(
+        self, locations, profile="driving-car", sources=None, destinations=None, **kwargs
+    ):
+        """Get durations and distances, see openrouteservice.Client.distance_matrix.
+
+        :param [(float, float)] locations: (longitude, latitude) list
+        :param str profile: only driving-car is supported
+        :param [int] sources: indexes of sources in locations, all by default
+        :param [int] destinations: indexes of destinations in locations, all by default
+        :return dict: durations (seconds) and distances (meters), None if route not found
+        """
+        nodes = [self._snap(lon, lat) for lon, lat in locations]
+        sources = range(len(locations)) if sources is None else sources
+        destinations = range(len(locations)) if destinations is None else destinations
+        backward = [self._upward_search(nodes[d], self._down) for d in destinations]
+        durations, distances = [], []
+        for s in sources:
+            forward = self._upward_search(nodes[s], self._up)
+            durations.append([])
+            distances.append([])
+            for b in backward:
+                meet = self._meet(forward, b)
+                durations[-1].append(None if meet is None else forward[meet][0] + b[meet][0])
+                distances[-1].append(None if meet is None else forward[meet][1] + b[meet][1])
+        return {"durations": durations, "distances": distances}
@@ -0,0 +1,166 @@
+"""Route image rendering with Pillow, without plotly and chromium."""
+import io
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WIDTH = 700
+IMAGE_HEIGHT = 500
+BACKGROUND_COLOR = "#e5e3df"
+# Mapbox zoom levels are defined for 512 pixel world tiles.
+WORLD_SIZE = 512
+TILE_SIZE = 256
+
+
+def project(latitude, longitude, zoom):
+    """Project coordinates to Web Mercator world pixels.
+
+    :param float latitude: latitude
+    :param float longitude: longitude
+    :param float zoom: Mapbox zoom
+    :return (float, float): x, y
+    """
+    size = WORLD_SIZE * 2**zoom
+    sin = math.sin(math.radians(latitude))
+    x = (longitude + 180) / 360 * size
+    y = (0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * size
+    return x, y
+
+
+def _draw_tiles(image, tiles, left, top, zoom):
+    """Draw map tiles covering the image.
+
+    :param PIL.Image.Image image: image
+    :param callable tiles: function(zoom, x, y) returning PNG tile bytes or None
+    :param float left: Image left edge, world pixels
+    :param float top: Image top edge, world pixels
+    :param float zoom: Mapbox zoom
+    """
+    from PIL import Image
+
+    # Use the next integer tile zoom and scale tiles down to the fractional zoom.
+    tile_zoom = math.ceil(zoom + math.log2(WORLD_SIZE / TILE_SIZE))
+    size = WORLD_SIZE * 2**zoom / 2**tile_zoom
+    pixel_size = math.ceil(size)
+    for x, y in _tile_grid(left, top, image.width, image.height, size, tile_zoom):
+        tile = tiles(tile_zoom, x % 2**tile_zoom, y)
+        if not tile:
+            continue
+        tile_image = Image.open(io.BytesIO(tile)).convert("RGB")
+        tile_image = tile_image.resize((pixel_size, pixel_size))
+        image.paste(tile_image, (round(x * size - left), round(y * size - top)))
+
+
+def covering_tiles(center, zoom, tile_zoom):
+    """Get map tiles covering a route image.
+
+    :param dict(lat=float, lon=float) center: Image center
+    :param float zoom: Mapbox zoom
+    :param int tile_zoom: Tile zoom
+    :return [(int, int)]: x and y of the tiles
+    """
+    center_x, center_y = project(center["lat"], center["lon"], zoom)
+    left, top = center_x - IMAGE_WIDTH / 2, center_y - IMAGE_HEIGHT / 2
+    size = WORLD_SIZE * 2**zoom / 2**tile_zoom
+    return [
+        (x % 2**tile_zoom, y)
+        for x, y in _tile_grid(left, top, IMAGE_WIDTH, IMAGE_HEIGHT, size, tile_zoom)
+    ]
+
+
+def _tile_grid(left, top, width, height, size, tile_zoom):
+    """Get tiles covering an area, x is not wrapped around the world.
+
+    :param float left: Area left edge, world pixels
+    :param float top: Area top edge, world pixels
+    :param int width: Area width, pixels
+    :param int height: Area height, pixels
+    :param float size: Tile size, world pixels
+    :param int tile_zoom: Tile zoom
+    :return iterator: x and y of the tiles
+    """
+    for x in range(math.floor(left / size), math.floor((left + width) / size) + 1):
+        for y in range(math.floor(top / size), math.floor((top + height) / size) + 1):
+            if 0 <= y < 2**tile_zoom:
+                yield x, y
+
+
+def _points(route, zoom):
+    return [project(lat, lon, zoom) for lat, lon in zip(route.lat, route.lon)]
+
+
+def ride_layer(ride_route, zoom):
+    """Draw ride route on a transparent layer.
+
+    The layer is positioned in world pixels, so it fits any image with the same zoom.
+
+    :param Route ride_route: route from start customer location to finish location
+    :param float zoom: Mapbox zoom
+    :return (int, int, PIL.Image.Image): layer left and top edges in world pixels and layer image
+    """
+    from PIL import Image, ImageDraw
+
+    points = _points(ride_route, zoom)
+    # Keep the line width around the route inside the layer.
+    left = math.floor(min(x for x, _ in points)) - 4
+    top = math.floor(min(y for _, y in points)) - 4
+    width = math.ceil(max(x for x, _ in points)) + 4 - left
+    height = math.ceil(max(y for _, y in points)) + 4 - top
+    layer = Image.new("RGBA", (width, height))
+    ImageDraw.Draw(layer).line(
+        [(x - left, y - top) for x, y in points], fill="blue", width=3, joint="curve"
+    )
+    return left, top, layer
+
+
+def save_variants(path, variants):
+    """Save smaller encodings of the image.
+
+    :param str path: Image local path
+    :param dict variants: variant path to dict(format, width, options), see route.IMAGE_VARIANTS
+    """
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image = image.convert("RGB")
+    for variant_path, variant in variants.items():
+        result = image
+        if variant["width"] and image.width > variant["width"]:
+            height = round(image.height * variant["width"] / image.width)
+            result = image.resize((variant["width"], height), Image.LANCZOS)
+        result.save(variant_path, format=variant["format"], **variant["options"])
+
+
+def save_route_image(
+    to_customer_route, ride_route, path, center, zoom, tiles=None, ride_layers=None
+):
+    """Draw routes on a map or a plain background and save the image.
+
+    :param Route to_customer_route: route from driver to customer
+    :param Route ride_route: route from start customer location to finish location
+    :param str path: Result image local path
+    :param dict(lat=float, lon=float) center: Image center
+    :param float zoom: Mapbox zoom
+    :param callable tiles: function(zoom, x, y) returning PNG tile bytes, None for plain background
+    :param RouteCache ride_layers: Cache of ride route layers by route and zoom
+    """
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (IMAGE_WIDTH, IMAGE_HEIGHT), BACKGROUND_COLOR)
+    center_x, center_y = project(center["lat"], center["lon"], zoom)
+    left, top = center_x - IMAGE_WIDTH / 2, center_y - IMAGE_HEIGHT / 2
+    if tiles:
+        _draw_tiles(image, tiles, left, top, zoom)
+    points = [(x - left, y - top) for x, y in _points(to_customer_route, zoom)]
+    ImageDraw.Draw(image).line(points, fill="green", width=4, joint="curve")
+    key = (ride_route.polyline, zoom)
+    layer = ride_layers.get(key) if ride_layers is not None else None
+    if not layer:
+        layer = ride_layer(ride_route, zoom)
+        if ride_layers is not None:
+            ride_layers.put(key, layer)
+    layer_left, layer_top, layer_image = layer
+    image.paste(layer_image, (round(layer_left - left), round(layer_top - top)), layer_image)
+    logger.debug("Image path: %s", path)
+    image.save(path, format="PNG")
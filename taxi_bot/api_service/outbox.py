@@ -0,0 +1,310 @@
+"""Transactional outbox of bot notifications.
+
+Notifications are added to the outbox table in the transaction of the state change and
+delivered by the dispatcher after commit, a slow or failing bot does not affect the API.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent import futures
+
+from taxi_bot.api_service import query
+from taxi_bot.api_service.rpc import (
+    BATCH_MAX_SIZE,
+    BATCH_RETRY_ERROR_CODES,
+    RpcError,
+    rpc_client,
+)
+from taxi_bot.api_service.schema import CUSTOMER_BOT, DRIVER_BOT, app, db
+
+logger = logging.getLogger(__name__)
+
+# A driver considers one offer at a time, offers not delivered yet are replaced by newer ones.
+OFFER_METHOD = "customer_found"
+
+
+def notify_customer(channel, messenger_id, method, params):
+    """Add customer notification to outbox.
+
+    :param str channel: Customer channel (telegram or viber)
+    :param str messenger_id: Customer messenger_id
+    :param str method: driver_found, driver_arrived, ride_started, ride_completed or driver_canceled
+    :param dict params: Additional parameters
+    """
+    query.add_outbox_message(
+        CUSTOMER_BOT, channel, messenger_id, method, json.dumps(params), params.get("order_id")
+    )
+
+
+def notify_driver(messenger_id, method, params):
+    """Add driver notification to outbox.
+
+    :param str messenger_id: Driver messenger_id
+    :param str method: customer_found or customer_canceled
+    :param dict params: Additional parameters
+    """
+    if method == OFFER_METHOD:
+        superseded = query.delete_outbox_messages_by_recipient(DRIVER_BOT, messenger_id, method)
+        if superseded:
+            outbox_dispatcher.superseded += superseded
+            logger.debug("offers superseded: messenger_id=%s count=%s", messenger_id, superseded)
+    query.add_outbox_message(
+        DRIVER_BOT, "telegram", messenger_id, method, json.dumps(params), params.get("order_id")
+    )
+
+
+class _OutboxDispatcher:
+    """Deliver outbox notifications.
+
+    Notifications of a recipient are delivered in the order they were added, different
+    recipients are notified concurrently by worker threads, so one slow bot call does not delay
+    the others. A failed notification is retried with exponential backoff and holds back
+    the later notifications of the same recipient. Offers of orders which are not waiting for
+    a driver anymore are dropped undelivered. With `batch`, due notifications of each bot
+    are sent in one `/rpc/batch` request per round. Until the dispatcher thread is started,
+    `wake` sends notifications from the calling thread without waiting for the bots and
+    applies the deliveries finished since the previous call, which is the only safe way
+    with an in-memory database, see `schema.is_memory_database`.
+    """
+
+    def __init__(self):
+        """Create stopped dispatcher."""
+        self.max_attempts = 10
+        self.retry_delay = 1
+        self.max_retry_delay = 300
+        self.poll_interval = 5
+        self.batch_size = 100
+        self.batch = False
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.superseded = 0
+        self.stale = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = futures.ThreadPoolExecutor(8, thread_name_prefix="outbox")
+        # Deliveries running in worker threads by recipient (bot, channel, messenger_id).
+        self._in_flight = {}
+
+    def set_config(
+        self, max_attempts=10, retry_delay=1, max_retry_delay=300, workers=8, batch=False
+    ):
+        """Set configuration.
+
+        :param int max_attempts: Delivery attempts before a notification is dropped
+        :param float retry_delay: Delay after the first failed attempt, seconds
+        :param float max_retry_delay: Maximum delay between attempts, seconds
+        :param int workers: Maximum number of recipients (bots with batch) notified at once
+        :param bool batch: Send notifications of a round to each bot in one batch request
+        """
+        self.max_attempts = max_attempts
+        self.batch = batch
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._executor.shutdown(wait=False)
+        self._executor = futures.ThreadPoolExecutor(workers, thread_name_prefix="outbox")
+
+    def start(self):
+        """Start dispatcher thread.
+
+        The thread uses its own database connection, so the database must not be in memory.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop dispatcher thread."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def wake(self):
+        """Deliver committed notifications, requires application context without the thread."""
+        if self._thread:
+            self._wakeup.set()
+        else:
+            self.dispatch(wait=False)
+
+    def dispatch(self, wait=True):
+        """Deliver due notifications, requires application context.
+
+        Only due notifications of recipients without an older notification waiting to be retried
+        are selected, so notifications backing off do not hold back other recipients.
+        Recipients are delivered to concurrently, the database is used by the calling thread only.
+        Results are applied as recipients finish, and notifications of other recipients which
+        became due meanwhile are sent while slow recipients are still in flight.
+
+        :param bool wait: Wait until notifications in flight are delivered, otherwise only apply
+            finished deliveries and send due notifications, the dispatcher thread is woken up
+            when a recipient finishes
+        :return float: time of the next delivery attempt or None if the outbox is empty
+        """
+        with self._lock:
+            next_attempt_at = self._dispatch_round()
+            while wait and self._in_flight:
+                futures.wait(self._in_flight.values(), return_when=futures.FIRST_COMPLETED)
+                next_attempt_at = self._dispatch_round()
+            return next_attempt_at
+
+    def _dispatch_round(self):
+        """Apply finished deliveries and send due notifications of recipients not in flight.
+
+        :return float: time of the next delivery attempt or None if the outbox is empty
+        """
+        now = time.time()
+        next_attempt_at = None
+        for recipient, task in list(self._in_flight.items()):
+            if not task.done():
+                continue
+            del self._in_flight[recipient]
+            delivered, failed, error = task.result()[recipient]
+            for message in delivered:
+                query.delete_outbox_message(message.outbox_id)
+            self.delivered += len(delivered)
+            if failed and self._failed(failed, error) is None:
+                # Dropped notification releases the next ones of the recipient right away.
+                next_attempt_at = now
+        stale = query.delete_outbox_messages_of_inactive_orders(OFFER_METHOD)
+        if stale:
+            self.stale += stale
+            logger.debug("stale offers dropped: count=%s", stale)
+        messages = []
+        limit = min(self.batch_size, BATCH_MAX_SIZE) if self.batch else self.batch_size
+        if len(self._in_flight) < limit:
+            messages = query.find_due_outbox_messages(now, limit, list(self._in_flight))
+        recipient_messages = {}
+        for message in messages:
+            # Detached rows are not expired by commit, workers read them without the session.
+            db.session.expunge(message)
+            recipient = (message.bot, message.channel, message.messenger_id)
+            recipient_messages.setdefault(recipient, []).append(message)
+        tasks = {}
+        if self.batch:
+            bots = {}
+            for recipient, recipient_list in recipient_messages.items():
+                bots.setdefault(recipient[0], {})[recipient] = recipient_list
+            for bot, bot_messages in bots.items():
+                task = self._executor.submit(self._deliver_batch, bot, bot_messages)
+                tasks.update(dict.fromkeys(bot_messages, task))
+        else:
+            for recipient, recipient_list in recipient_messages.items():
+                tasks[recipient] = self._executor.submit(
+                    self._deliver_all, recipient, recipient_list
+                )
+        for task in set(tasks.values()):
+            task.add_done_callback(lambda _: self._wakeup.set())
+        self._in_flight.update(tasks)
+        db.session.commit()
+        if len(messages) == limit:
+            # The whole batch is sent, continue with the next one right away.
+            next_attempt_at = now
+        if next_attempt_at is None:
+            next_attempt_at = query.find_outbox_next_attempt_at(now)
+        return next_attempt_at
+
+    def _deliver_all(self, recipient, messages):
+        """Deliver recipient notifications in order until the first failure.
+
+        :param tuple recipient: Recipient (bot, channel, messenger_id)
+        :param [OutboxTable] messages: Notifications of the recipient
+        :return dict: recipient to delivered notifications, failed notification and error
+        """
+        for number, message in enumerate(messages):
+            try:
+                self._deliver(message)
+            except Exception as e:
+                return {recipient: (messages[:number], message, e)}
+        return {recipient: (messages, None, None)}
+
+    def _deliver_batch(self, bot, recipient_messages):
+        """Deliver notifications of many recipients with one batch request.
+
+        The bot processes notifications of each recipient in order and skips the ones after
+        a failed notification, see `taxi_bot.rpc_batch`. Only skipped notifications and
+        internal bot errors are retried, other errors are final like for single calls.
+
+        :param str bot: CUSTOMER_BOT or DRIVER_BOT
+        :param dict recipient_messages: Recipient to its notifications
+        :return dict: recipient to delivered notifications, failed notification and error
+        """
+        calls = [
+            (message.channel, message.messenger_id, message.method, json.loads(message.params))
+            for messages in recipient_messages.values()
+            for message in messages
+        ]
+        notify = rpc_client.notify_customers if bot == CUSTOMER_BOT else rpc_client.notify_drivers
+        try:
+            errors = notify(calls)
+        except Exception as e:
+            return {
+                recipient: ([], messages[0], e)
+                for recipient, messages in recipient_messages.items()
+            }
+        results, start = {}, 0
+        for recipient, messages in recipient_messages.items():
+            recipient_errors = errors[start : start + len(messages)]
+            start += len(messages)
+            failed = next(
+                (
+                    n
+                    for n, error in enumerate(recipient_errors)
+                    if error and error.get("code") in BATCH_RETRY_ERROR_CODES
+                ),
+                None,
+            )
+            for message, error in zip(messages, recipient_errors[:failed]):
+                if error:
+                    # Delivered like a single call answered with an error.
+                    logger.warning("notification rejected: %r error=%r", message, error)
+            if failed is None:
+                results[recipient] = (messages, None, None)
+            else:
+                # The bot skipped the next notifications, they are retried after the failed one.
+                error = RpcError(recipient_errors[failed])
+                results[recipient] = (messages[:failed], messages[failed], error)
+        return results
+
+    def _deliver(self, message):
+        params = json.loads(message.params)
+        if message.bot == CUSTOMER_BOT:
+            rpc_client.notify_customer(
+                message.channel, message.messenger_id, message.method, params
+            )
+        else:
+            rpc_client.notify_driver(message.messenger_id, message.method, params)
+
+    def _failed(self, message, error):
+        attempts = message.attempts + 1
+        if attempts >= self.max_attempts:
+            logger.error("notification dropped: %r error=%r", message, error)
+            query.delete_outbox_message(message.outbox_id)
+            self.dropped += 1
+            return None
+        retry_at = time.time() + min(self.max_retry_delay, self.retry_delay * 2 ** (attempts - 1))
+        self.failed += 1
+        logger.warning("notification failed: %r error=%r", message, error)
+        query.update_outbox_message_attempts(message.outbox_id, attempts, retry_at)
+        return retry_at
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with app.app_context():
+                    next_attempt_at = self.dispatch(wait=False)
+            except Exception:
+                logger.exception("outbox dispatch failed")
+                next_attempt_at = time.time() + self.retry_delay
+            timeout = self.poll_interval
+            if next_attempt_at is not None:
+                timeout = min(timeout, max(0, next_attempt_at - time.time()))
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+
+outbox_dispatcher = _OutboxDispatcher()
@@ -1,7 +1,8 @@
 """DB queries."""
 
-from sqlalchemy import or_, select, update
+from sqlalchemy import delete, func, or_, select, tuple_, update
 from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import aliased
 
 from taxi_bot.api_service.schema import (
     CANCELED_ORDER_STATE,
@@ -15,6 +16,7 @@ from taxi_bot.api_service.schema import (
     DriverRequestTable,
     DriverTable,
     OrderTable,
+    OutboxTable,
     db,
 )
 
@@ -87,6 +89,20 @@ def add_driver_reject_order(driver_id, order_id):
     return reject
 
 
+def add_outbox_message(bot, channel, messenger_id, method, params, order_id=None):
+    """Add new notification to outbox."""
+    message = OutboxTable(
+        bot=bot,
+        channel=channel,
+        messenger_id=messenger_id,
+        method=method,
+        params=params,
+        order_id=order_id,
+    )
+    db.session.add(message)
+    return message
+
+
 def update_order_driver_id_by_order_id(order_id, driver_id):
     """Update order driver_id and set state to 'confirmed' by order_id."""
     stmt = (
@@ -103,6 +119,16 @@ def update_order_state_by_order_id(order_id, state):
     db.session.execute(stmt)
 
 
+def update_order_ride_by_order_id(order_id, ride_summary, ride_polyline):
+    """Update order ride route summary and geometry by order_id."""
+    stmt = (
+        update(OrderTable)
+        .where(OrderTable.order_id == order_id)
+        .values(ride_summary=ride_summary, ride_polyline=ride_polyline)
+    )
+    db.session.execute(stmt)
+
+
 def update_driver_request_state_by_driver_id(driver_id, current_state, new_state):
     """Update driver_request state by driver_id with current state."""
     stmt = (
@@ -185,6 +211,7 @@ def find_driver_request_by_driver_id_for_update(driver_id):
             DriverRequestTable.driver_id,
             DriverRequestTable.latitude,
             DriverRequestTable.longitude,
+            DriverRequestTable.radius,
             DriverRequestTable.ride_summary,
             DriverRequestTable.to_customer_summary,
             DriverRequestTable.image_url,
@@ -223,9 +250,20 @@ def find_all_active_orders(driver_id):
 
 def find_all_driver_requests():
     """Select all driver requests with state=INIT_REQUEST_STATE."""
-    query = (
+    return _driver_requests_query().all()
+
+
+def find_driver_requests_by_driver_ids(driver_ids):
+    """Select driver requests with state=INIT_REQUEST_STATE by driver_id list."""
+    query = _driver_requests_query().where(DriverRequestTable.driver_id.in_(driver_ids))
+    return query.order_by(DriverRequestTable.driver_request_id).all()
+
+
+def _driver_requests_query():
+    return (
         db.session.query(
             DriverRequestTable.driver_request_id,
+            DriverRequestTable.driver_id,
             DriverRequestTable.latitude,
             DriverRequestTable.longitude,
             DriverRequestTable.radius,
@@ -237,4 +275,103 @@ def find_all_driver_requests():
         .join(DriverTable, DriverTable.driver_id == DriverRequestTable.driver_id)
         .where(DriverRequestTable.state == INIT_REQUEST_STATE)
     )
-    return query.all()
+
+
+def find_active_image_urls():
+    """Select image urls of driver requests with state=INIT_REQUEST_STATE or CONFIRMED_REQUEST_STATE."""
+    stmt = (
+        select(DriverRequestTable.image_url)
+        .where(DriverRequestTable.state.in_([INIT_REQUEST_STATE, CONFIRMED_REQUEST_STATE]))
+        .where(DriverRequestTable.image_url.is_not(None))
+    )
+    return db.session.scalars(stmt).all()
+
+
+def update_outbox_message_attempts(outbox_id, attempts, next_attempt_at):
+    """Update outbox message delivery attempts by outbox_id."""
+    stmt = (
+        update(OutboxTable)
+        .where(OutboxTable.outbox_id == outbox_id)
+        .values(attempts=attempts, next_attempt_at=next_attempt_at)
+    )
+    db.session.execute(stmt)
+
+
+def delete_outbox_message(outbox_id):
+    """Delete outbox message by outbox_id."""
+    db.session.execute(delete(OutboxTable).where(OutboxTable.outbox_id == outbox_id))
+
+
+def delete_outbox_messages_by_recipient(bot, messenger_id, method):
+    """Delete undelivered recipient notifications by method.
+
+    :return int: number of deleted notifications
+    """
+    stmt = delete(OutboxTable).where(
+        OutboxTable.bot == bot,
+        OutboxTable.messenger_id == messenger_id,
+        OutboxTable.method == method,
+    )
+    return db.session.execute(stmt).rowcount
+
+
+def delete_outbox_messages_of_inactive_orders(method):
+    """Delete undelivered notifications by method if their order state is not 'init'.
+
+    :return int: number of deleted notifications
+    """
+    inactive_orders = select(OrderTable.order_id).where(OrderTable.state != INIT_ORDER_STATE)
+    stmt = delete(OutboxTable).where(
+        OutboxTable.method == method, OutboxTable.order_id.in_(inactive_orders)
+    )
+    return db.session.execute(stmt).rowcount
+
+
+def find_outbox_messages(limit):
+    """Select the oldest outbox messages."""
+    stmt = select(OutboxTable).order_by(OutboxTable.outbox_id).limit(limit)
+    return db.session.scalars(stmt).all()
+
+
+def find_due_outbox_messages(now, limit, excluded_recipients=()):
+    """Select the oldest due outbox messages of recipients without older messages waiting to be retried.
+
+    :param float now: Current time
+    :param int limit: Maximum number of messages
+    :param [(str, str, str)] excluded_recipients: (bot, channel, messenger_id) to skip
+    :return [OutboxTable]: messages
+    """
+    older = aliased(OutboxTable)
+    waiting = (
+        select(older.outbox_id)
+        .where(
+            older.messenger_id == OutboxTable.messenger_id,
+            older.bot == OutboxTable.bot,
+            older.channel == OutboxTable.channel,
+            older.outbox_id < OutboxTable.outbox_id,
+            older.next_attempt_at > now,
+        )
+        .exists()
+    )
+    stmt = (
+        select(OutboxTable)
+        .where(OutboxTable.next_attempt_at <= now, ~waiting)
+        .where(
+            tuple_(OutboxTable.bot, OutboxTable.channel, OutboxTable.messenger_id).not_in(
+                excluded_recipients
+            )
+        )
+        .order_by(OutboxTable.outbox_id)
+        .limit(limit)
+    )
+    return db.session.scalars(stmt).all()
+
+
+def find_outbox_next_attempt_at(now):
+    """Select the earliest delivery attempt time of outbox messages which are not due.
+
+    :param float now: Current time
+    :return float: time or None
+    """
+    stmt = select(func.min(OutboxTable.next_attempt_at)).where(OutboxTable.next_attempt_at > now)
+    return db.session.scalar(stmt)
@@ -0,0 +1,193 @@
+"""Background route image rendering."""
+import logging
+import multiprocessing
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueue:
+    """Queue of images rendered by background worker threads.
+
+    Image names are known before rendering, so an image url can be handed out right away
+    and the image download waits until the image is rendered.
+    """
+
+    def __init__(self):
+        """Create queue, workers are started on first use."""
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._workers = []
+
+    def start(self, workers=1):
+        """Start worker threads.
+
+        :param int workers: Number of worker threads
+        """
+        with self._lock:
+            while len(self._workers) < workers:
+                worker = threading.Thread(
+                    target=self._work, name=f"render-{len(self._workers)}", daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, name, render, *args):
+        """Add image to queue.
+
+        :param str name: Image name
+        :param callable render: Function which renders image
+        :param args: Function arguments
+        :return bool: False if the image with the same name is already queued
+        """
+        if not self._workers:
+            self.start()
+        with self._lock:
+            if name in self._pending:
+                return False
+            self._pending[name] = threading.Event()
+        self._queue.put((name, render, args))
+        logger.debug("render queued: name=%s queue=%s", name, self._queue.qsize())
+        return True
+
+    def wait(self, name, timeout):
+        """Wait until image is rendered.
+
+        :param str name: Image name
+        :param float timeout: Maximum wait time, seconds
+        :return bool: False if image is still pending after timeout
+        """
+        with self._lock:
+            done = self._pending.get(name)
+        return done is None or done.wait(timeout)
+
+    def join(self):
+        """Wait until all queued images are rendered."""
+        self._queue.join()
+
+    def _work(self):
+        while True:
+            name, render, args = self._queue.get()
+            try:
+                render(*args)
+            except Exception:
+                logger.exception("render failed: name=%s", name)
+            finally:
+                with self._lock:
+                    done = self._pending.pop(name, None)
+                if done:
+                    done.set()
+                self._queue.task_done()
+
+
+def kaleido_renderer():
+    """Create kaleido renderer with a warm chromium process.
+
+    :return callable: function(figure, path) saving figure dict as png
+    """
+    from kaleido.scopes.plotly import PlotlyScope
+
+    scope = PlotlyScope()
+    # The first transform starts chromium, do it before taking figures.
+    scope.transform({"data": [], "layout": {}}, format="png")
+
+    def render(figure, path):
+        image = scope.transform(figure, format="png")
+        with open(path, "wb") as f:
+            f.write(image)
+
+    return render
+
+
+def _renderer_main(conn, renderer_factory):
+    """Renderer process loop.
+
+    :param multiprocessing.connection.Connection conn: Connection to the service process
+    :param callable renderer_factory: Function returning function(figure, path)
+    """
+    render = renderer_factory()
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        try:
+            render(*task)
+            conn.send(None)
+        except Exception as e:
+            conn.send(repr(e))
+
+
+class _Renderer:
+    """Renderer process and connection to it."""
+
+    def __init__(self, context, renderer_factory, number):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_renderer_main,
+            args=(child_conn, renderer_factory),
+            name=f"renderer-{number}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        self.conn.close()
+        self.process.kill()
+        self.process.join()
+
+
+class RendererPool:
+    """Pool of warm renderer processes.
+
+    kaleido is not safe to use from several threads and starting chromium takes seconds,
+    so every process keeps its own chromium running and renders one figure at a time.
+    A crashed or hung process is replaced by a new one.
+    """
+
+    def __init__(self, processes, renderer_factory=kaleido_renderer, timeout=60):
+        """Start renderer processes.
+
+        :param int processes: Number of processes
+        :param callable renderer_factory: Module level function returning function(figure, path)
+        :param float timeout: Maximum render time including process start, seconds
+        """
+        self.timeout = timeout
+        self.restarts = 0
+        self._renderer_factory = renderer_factory
+        # Spawn does not copy threads and locks of the service process.
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        for number in range(processes):
+            self._idle.put(_Renderer(self._context, renderer_factory, number))
+
+    def render(self, figure, path):
+        """Render figure in an idle process.
+
+        :param dict figure: Plotly figure dict
+        :param str path: Result image local path
+        :raise RuntimeError: render failed
+        """
+        renderer = self._idle.get()
+        try:
+            renderer.conn.send((figure, path))
+            if not renderer.conn.poll(self.timeout):
+                raise TimeoutError("Render timeout")
+            error = renderer.conn.recv()
+        except (EOFError, OSError, TimeoutError) as e:
+            logger.error("renderer %s failed: %r, restarting", renderer.process.name, e)
+            renderer.stop()
+            renderer = _Renderer(self._context, self._renderer_factory, self.restarts)
+            self.restarts += 1
+            raise RuntimeError("Renderer process failed") from e
+        finally:
+            self._idle.put(renderer)
+        if error:
+            raise RuntimeError(error)
+
+    def close(self):
+        """Stop all processes."""
+        while not self._idle.empty():
+            self._idle.get().stop()
@@ -1,14 +1,58 @@
 """Openrouteservice client."""
+import functools
+import hashlib
+import json
 import logging
-import uuid
+import math
+import os
+import time
+from concurrent import futures
 
 import openrouteservice
 import plotly.graph_objects as go
 from haversine import haversine
-from openrouteservice import convert, exceptions
+from openrouteservice import exceptions
+
+from taxi_bot.api_service import map_image
+from taxi_bot.api_service.geometry import Route
+from taxi_bot.api_service.janitor import image_key, image_path
+from taxi_bot.api_service.local_routing import LocalRoutingClient
+from taxi_bot.api_service.render import RendererPool, RenderQueue
+from taxi_bot.api_service.route_cache import (
+    LruCache,
+    PersistentRouteCache,
+    RouteCache,
+    SingleFlight,
+)
+from taxi_bot.api_service.tile_cache import TileCache
 
 logger = logging.getLogger(__name__)
 
+ORS_PROFILE = "driving-car"
+
+# Openrouteservice matrix API limits the number of routes (sources x destinations)
+# per request, keep chunks well below it.
+MATRIX_CHUNK_SIZE = 50
+
+# Everything except the routes which changes the route image, part of image names.
+IMAGE_SETTINGS = {"renderer": "plotly", "style": "open-street-map", "format": "png", "version": 1}
+
+# Smaller image encodings for messenger channels, made from the rendered image.
+IMAGE_VARIANTS = {
+    "telegram": {
+        "format": "PNG",
+        "extension": "png",
+        "width": None,
+        "options": {"optimize": True},
+    },
+    "viber": {
+        "format": "JPEG",
+        "extension": "jpg",
+        "width": 480,
+        "options": {"quality": 80, "optimize": True},
+    },
+}
+
 
 def _zoom(min_lat, max_lat, min_lon, max_lon):
     """Get (empirical) zoom parameter depending from route rectangle.
@@ -45,19 +89,29 @@ def _zoom(min_lat, max_lat, min_lon, max_lon):
     return result
 
 
-def _save_route_image(to_customer_route, ride_route, path):
+def _save_route_image(
+    to_customer_route,
+    ride_route,
+    path,
+    renderer_pool=None,
+    tile_layer_url=None,
+    tile_cache=None,
+):
     """Create and save image with route.
 
-    :param [dict(lat=float, lon=float})] to_customer_route: route from driver to customer.
-    :param [dict(lat=float, lon=float})] ride_route: route from start customer location to finish location
+    :param Route to_customer_route: route from driver to customer.
+    :param Route ride_route: route from start customer location to finish location
     :param path str: Result image local path
+    :param RendererPool renderer_pool: Renderer processes, None renders in the calling thread
+    :param str tile_layer_url: Base map tile url template, None uses open-street-map style
+    :param TileCache tile_cache: Tiles served at tile_layer_url, the image tiles are cached first
     """
     fig = go.Figure(
         go.Scattermapbox(
             mode="lines",
             name="Route to customer",
-            lon=to_customer_route["lon"],
-            lat=to_customer_route["lat"],
+            lon=list(to_customer_route.lon),
+            lat=list(to_customer_route.lat),
             line={"width": 4, "color": "green"},
         )
     )
@@ -65,22 +119,161 @@ def _save_route_image(to_customer_route, ride_route, path):
         go.Scattermapbox(
             mode="lines",
             name="Ride route",
-            lon=ride_route["lon"],
-            lat=ride_route["lat"],
+            lon=list(ride_route.lon),
+            lat=list(ride_route.lat),
             line={"width": 3, "color": "blue"},
         )
     )
-    max_lon = max(ride_route["lon"] + to_customer_route["lon"])
-    min_lon = min(ride_route["lon"] + to_customer_route["lon"])
-    max_lat = max(ride_route["lat"] + to_customer_route["lat"])
-    min_lat = min(ride_route["lat"] + to_customer_route["lat"])
-    center = {"lon": (max_lon + min_lon) / 2, "lat": (max_lat + min_lat) / 2}
-    zoom = _zoom(min_lat, max_lat, min_lon, max_lon)
-    mapbox = {"center": center, "style": "open-street-map", "zoom": zoom}
+    center, zoom = _route_view(to_customer_route, ride_route)
+    mapbox = {"center": center, "style": IMAGE_SETTINGS["style"], "zoom": zoom}
+    if tile_layer_url:
+        if tile_cache:
+            # Mapbox loads raster tiles of the rounded zoom, the service serves cached tiles only.
+            tile_zoom = round(zoom)
+            for x, y in map_image.covering_tiles(center, zoom, tile_zoom):
+                tile_cache.get(tile_zoom, x, y)
+        mapbox["style"] = "white-bg"
+        mapbox["layers"] = [
+            {"below": "traces", "sourcetype": "raster", "source": [tile_layer_url]}
+        ]
     fig.update_layout(margin={"l": 0, "t": 0, "b": 0, "r": 0}, mapbox=mapbox)
     fig.update(layout_showlegend=False)
     logger.debug("Image path: %s", path)
-    fig.write_image(path)
+    if renderer_pool:
+        renderer_pool.render(fig.to_plotly_json(), path)
+    else:
+        fig.write_image(path)
+
+
+def _save_route_image_pillow(
+    to_customer_route, ride_route, path, tile_cache=None, ride_layers=None
+):
+    """Create and save image with route using Pillow.
+
+    :param Route to_customer_route: route from driver to customer.
+    :param Route ride_route: route from start customer location to finish location
+    :param path str: Result image local path
+    :param TileCache tile_cache: Base map tiles, None draws plain background
+    :param RouteCache ride_layers: Cache of rendered ride route layers by route and zoom level
+    """
+    center, zoom = _route_view(to_customer_route, ride_route)
+    tiles = tile_cache.get if tile_cache else None
+    map_image.save_route_image(
+        to_customer_route, ride_route, path, center, zoom, tiles, ride_layers
+    )
+
+
+def _route_view(to_customer_route, ride_route):
+    """Get image center and zoom showing both routes.
+
+    :param Route to_customer_route: route from driver to customer.
+    :param Route ride_route: route from start customer location to finish location
+    :return (dict(lat=float, lon=float), float): center and zoom
+    """
+    max_lon = max(ride_route.max_lon, to_customer_route.max_lon)
+    min_lon = min(ride_route.min_lon, to_customer_route.min_lon)
+    max_lat = max(ride_route.max_lat, to_customer_route.max_lat)
+    min_lat = min(ride_route.min_lat, to_customer_route.min_lat)
+    center = {"lon": (max_lon + min_lon) / 2, "lat": (max_lat + min_lat) / 2}
+    return center, _zoom(min_lat, max_lat, min_lon, max_lon)
+
+
+def _image_name(to_customer_route, ride_route, settings):
+    """Get route image file name.
+
+    :param Route to_customer_route: route to customer
+    :param Route ride_route: ride route
+    :param dict settings: Image settings, see IMAGE_SETTINGS
+    :return str: file name
+    """
+    content = [settings, to_customer_route.polyline, ride_route.polyline]
+    digest = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+    return f"{digest}.{settings['format']}"
+
+
+def _variant_name(name, channel):
+    """Get image variant name, path or url.
+
+    :param str name: image name, path or url
+    :param str channel: IMAGE_VARIANTS key
+    :return str: variant name, path or url
+    """
+    return f"{os.path.splitext(name)[0]}.{channel}.{IMAGE_VARIANTS[channel]['extension']}"
+
+
+def _touch(paths):
+    """Update modification time of existing files.
+
+    :param [str] paths: file paths
+    :return bool: True if all files exist
+    """
+    try:
+        for path in paths:
+            os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def simplify_route(route, tolerance):
+    """Simplify route with Douglas-Peucker algorithm.
+
+    Points closer than `tolerance` pixels to the simplified line are removed. Pixels are
+    measured at the zoom of the route image showing the whole route, images with other routes
+    have the same or a smaller zoom, so the removed points are not visible there either.
+
+    :param Route route: route
+    :param float tolerance: Maximum deviation, pixels, 0 keeps all points
+    :return Route: route
+    """
+    if tolerance <= 0 or len(route) < 3:
+        return route
+    zoom = _zoom(route.min_lat, route.max_lat, route.min_lon, route.max_lon)
+    points = [map_image.project(lat, lon, zoom) for lat, lon in zip(route.lat, route.lon)]
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        index, max_distance = None, tolerance
+        for i in range(first + 1, last):
+            distance = _segment_distance(points[i], points[first], points[last])
+            if distance > max_distance:
+                index, max_distance = i, distance
+        if index is not None:
+            keep[index] = True
+            stack.extend(((first, index), (index, last)))
+    simplified = Route(
+        (c for c, k in zip(route.lon, keep) if k), (c for c, k in zip(route.lat, keep) if k)
+    )
+    logger.debug("route simplified: points=%s simplified=%s", len(route), len(simplified))
+    return simplified
+
+
+def _segment_distance(point, start, end):
+    """Get distance from point to segment.
+
+    :param (float, float) point: point
+    :param (float, float) start: segment start
+    :param (float, float) end: segment end
+    :return float: distance
+    """
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    length = dx * dx + dy * dy
+    t = 0
+    if length:
+        t = max(0, min(1, ((point[0] - start[0]) * dx + (point[1] - start[1]) * dy) / length))
+    return math.hypot(point[0] - start[0] - t * dx, point[1] - start[1] - t * dy)
+
+
+def _summary(duration, distance):
+    """Convert openrouteservice duration and distance to route summary.
+
+    :param float duration: duration, seconds
+    :param float distance: distance, meters
+    :return dict(duration, distance): duration in minutes and distance in kilometers
+    """
+    return {"duration": round(duration / 60), "distance": round(distance / 1000, 2)}
 
 
 class _RouteClient:
@@ -88,6 +281,7 @@ class _RouteClient:
 
     See https://openrouteservice.org/ service for create route
     See https://github.com/GIScience/openrouteservice-py client library for openrouteservice
+    See LocalRoutingClient for offline routing backend with the same interface
     See https://plotly.com/python/ create geo-map image with routes
 
     Route colors:
@@ -99,17 +293,130 @@ class _RouteClient:
         self.client = None
         self.upload_image_path = None
         self.image_storage_url = None
+        self.route_cache = RouteCache()
+        self.persistent_route_cache = None
+        self.cache_namespace = ORS_PROFILE
+        self.route_deadline = 30
+        self.route_simplify_tolerance = 1
+        self._single_flight = SingleFlight()
+        self.render_queue = RenderQueue()
+        self.renderer_pool = None
+        self.image_settings = IMAGE_SETTINGS
+        self.image_variants = False
+        self.tile_cache = None
+        self.tile_layer_url = None
+        # Drivers offered the same order at the same zoom level share the ride route layer,
+        # only the pillow renderer draws layers.
+        self.ride_layers = RouteCache(maxsize=64, ttl=600)
+        self.image_cache = LruCache(maxsize=64)
+        self.image_hits = 0
+        self.image_misses = 0
+        self._executor = futures.ThreadPoolExecutor(8, thread_name_prefix="ors")
 
-    def set_config(self, upload_image_path, image_storage_url, open_route_service_key):
+    def set_config(
+        self,
+        upload_image_path,
+        image_storage_url,
+        open_route_service_key,
+        route_cache_size=1024,
+        route_cache_ttl=3600,
+        route_cache_precision=5,
+        route_cache_path=None,
+        route_cache_file_size=100000,
+        route_cache_file_ttl=604800,
+        osm_path=None,
+        route_concurrency=8,
+        route_deadline=30,
+        render_workers=1,
+        renderer_processes=0,
+        image_renderer="plotly",
+        tile_cache_path=None,
+        tile_url=None,
+        tile_user_agent=None,
+        tile_cache_bytes=500_000_000,
+        tile_layer_url=None,
+        route_simplify_tolerance=1,
+        image_cache_size=64,
+        image_variants=False,
+    ):
         """Set configuration.
 
         :param str upload_image_path: Local path for image storage
         :param str image_storage_url: Image storage url
         :param str open_route_service_key: See https://openrouteservice.org/dev/#/api-docs
+        :param int route_cache_size: Maximum number of cached routes, 0 disables the cache
+        :param float route_cache_ttl: Cached route time to live, seconds
+        :param int route_cache_precision: Number of decimal places of cached route coordinates
+        :param str route_cache_path: SQLite file of persistent route cache, None disables it
+        :param int route_cache_file_size: Maximum number of routes in persistent route cache
+        :param float route_cache_file_ttl: Persistent route cache time to live, seconds
+        :param str osm_path: OpenStreetMap XML extract for offline routing instead of openrouteservice
+        :param int route_concurrency: Maximum number of concurrent routing requests
+        :param float route_deadline: Maximum time to wait for routing requests of one API request,
+            seconds, see `deadline`
+        :param int render_workers: Number of background image rendering threads
+        :param int renderer_processes: Number of warm kaleido processes, 0 renders in threads,
+            at least as many rendering threads are started
+        :param str image_renderer: Route image renderer, "plotly" or "pillow"
+        :param str tile_cache_path: Local map tile directory, None downloads tiles on every render
+        :param str tile_url: Tile server url template for missing tiles, None uses local tiles only
+        :param str tile_user_agent: User-Agent of tile downloads from tile_url, with a contact
+        :param int tile_cache_bytes: Maximum tile directory size, bytes
+        :param str tile_layer_url: Service tile url template loaded by plotly images
+        :param float route_simplify_tolerance: Maximum route simplification error, image pixels
+        :param int image_cache_size: Number of recently downloaded images kept in memory
+        :param bool image_variants: Make IMAGE_VARIANTS of every route image, requires Pillow
+        :raise ImportError: Pillow is required but not installed
         """
-        self.client = openrouteservice.Client(key=open_route_service_key)
+        if image_renderer == "pillow" or image_variants:
+            # Fail on startup rather than in every background render.
+            try:
+                import PIL  # noqa: F401
+            except ImportError as exc:
+                raise ImportError(
+                    "Pillow is required for the pillow renderer and image variants, "
+                    "install taxi_bot[pillow]"
+                ) from exc
+        if osm_path:
+            self.client = LocalRoutingClient(osm_path)
+            self.cache_namespace = f"local-{ORS_PROFILE}"
+        else:
+            self.client = openrouteservice.Client(key=open_route_service_key)
+            self.cache_namespace = ORS_PROFILE
         self.upload_image_path = upload_image_path
         self.image_storage_url = image_storage_url
+        self.route_cache = RouteCache(route_cache_size, route_cache_ttl, route_cache_precision)
+        self.persistent_route_cache = None
+        if route_cache_path:
+            self.persistent_route_cache = PersistentRouteCache(
+                route_cache_path, route_cache_file_size, route_cache_file_ttl
+            )
+        self.route_deadline = route_deadline
+        self.route_simplify_tolerance = route_simplify_tolerance
+        self.image_cache = LruCache(image_cache_size)
+        self._executor.shutdown(wait=False)
+        self._executor = futures.ThreadPoolExecutor(route_concurrency, thread_name_prefix="ors")
+        if self.renderer_pool:
+            self.renderer_pool.close()
+        self.renderer_pool = None
+        if image_renderer == "plotly" and renderer_processes:
+            self.renderer_pool = RendererPool(renderer_processes)
+        self.tile_cache = None
+        self.tile_layer_url = None
+        self.image_settings = dict(IMAGE_SETTINGS, renderer=image_renderer)
+        self.image_variants = image_variants
+        if image_variants:
+            self.image_settings["variants"] = IMAGE_VARIANTS
+        if tile_cache_path:
+            self.tile_cache = TileCache(
+                tile_cache_path, tile_url, tile_cache_bytes, user_agent=tile_user_agent
+            )
+            self.tile_layer_url = tile_layer_url
+            self.image_settings["tiles"] = tile_url or tile_cache_path
+        if self.renderer_pool:
+            # Every renderer process is fed by its own rendering thread.
+            render_workers = max(render_workers, renderer_processes)
+        self.render_queue.start(render_workers)
 
     def get_ors_route(
         self,
@@ -124,49 +431,287 @@ class _RouteClient:
         :param float start_longitude: start longitude
         :param float finish_latitude: finish latitude
         :param float finish_longitude: finish longitude
-        :return [dict(lat=float, lon=float})], dict(duration, distance))
+        :return (Route, dict(duration, distance)): route shared by all callers and summary,
+            the summary is a new dict on every call
+        """
+        key = self.route_cache.key(
+            start_latitude, start_longitude, finish_latitude, finish_longitude
+        )
+        cached = self._get_cached_route(key)
+        if cached is None:
+            # Concurrent requests of the same route wait for a single ORS request.
+            cached = self._single_flight.do(
+                key,
+                functools.partial(
+                    self._fetch_route,
+                    key,
+                    start_latitude,
+                    start_longitude,
+                    finish_latitude,
+                    finish_longitude,
+                ),
+            )
+            # Skip if received any ORS error.
+            if cached is None:
+                return None
+        logger.debug(
+            "route cache: hits=%s misses=%s size=%s shared=%s",
+            self.route_cache.hits,
+            self.route_cache.misses,
+            len(self.route_cache),
+            self._single_flight.shared,
+        )
+        route, duration, distance = cached
+        return route, _summary(duration, distance)
+
+    def _fetch_route(
+        self, key, start_latitude, start_longitude, finish_latitude, finish_longitude
+    ):
+        """Request route and put it to the cache.
+
+        :param tuple key: route cache key
+        :return (Route, float, float): route, duration and
+            distance or None on ORS error
         """
+        # The route may have been cached by another request while waiting.
+        cached = self.route_cache.peek(key)
+        if cached is not None:
+            return cached
         coords = (
             (start_longitude, start_latitude),
             (finish_longitude, finish_latitude),
         )
-        data = None
+        data = self._request(self.client.directions, coords, profile=ORS_PROFILE)
+        if not data:
+            return None
+        route = simplify_route(
+            Route.decode(data["routes"][0]["geometry"]), self.route_simplify_tolerance
+        )
+        summary = data["routes"][0]["summary"]
+        # Cached route is shared by all callers, store it immutable.
+        cached = (route, summary.get("duration", 0), summary.get("distance", 0))
+        self._put_cached_route(key, cached)
+        return cached
+
+    def deadline(self):
+        """Get deadline of routing requests made for one API request.
+
+        Pass it to every routing phase of the request, so all phases together wait at most
+        `route_deadline`.
+
+        :return float: time.monotonic() deadline
+        """
+        return time.monotonic() + self.route_deadline
+
+    def get_ors_distances(self, origins, destinations, deadline=None):
+        """Get road distances for one-to-many or many-to-one locations.
+
+        Uses openrouteservice matrix API, large requests are split into chunks.
+
+        :param [(float, float)] origins: (latitude, longitude) list of start locations
+        :param [(float, float)] destinations: (latitude, longitude) list of finish locations
+        :param float deadline: time.monotonic() deadline, see `deadline`, None waits
+            `route_deadline`
+        :return [dict(duration, distance)]: summary for every origin (many-to-one)
+            or for every destination (one-to-many), None if route not found
+        """
+        if len(destinations) == 1:
+            many, one, many_to_one = origins, destinations[0], True
+        elif len(origins) == 1:
+            many, one, many_to_one = destinations, origins[0], False
+        else:
+            raise ValueError("One-to-many or many-to-one locations expected")
+        chunks = [many[i : i + MATRIX_CHUNK_SIZE] for i in range(0, len(many), MATRIX_CHUNK_SIZE)]
+        requests = []
+        for chunk in chunks:
+            locations = [(lon, lat) for lat, lon in chunk] + [(one[1], one[0])]
+            indexes, one_index = list(range(len(chunk))), [len(chunk)]
+            matrix = functools.partial(
+                self.client.distance_matrix,
+                locations,
+                profile=ORS_PROFILE,
+                sources=indexes if many_to_one else one_index,
+                destinations=one_index if many_to_one else indexes,
+                metrics=["distance", "duration"],
+            )
+            requests.append((matrix,))
+        result = []
+        for chunk, data in zip(chunks, self._map(self._request, requests, deadline)):
+            # Skip if received any ORS error.
+            if not data:
+                result.extend([None] * len(chunk))
+                continue
+            if many_to_one:
+                durations = [row[0] for row in data["durations"]]
+                distances = [row[0] for row in data["distances"]]
+            else:
+                durations, distances = data["durations"][0], data["distances"][0]
+            result.extend(
+                None if distance is None else _summary(duration or 0, distance)
+                for duration, distance in zip(durations, distances)
+            )
+        return result
+
+    def get_ors_routes(self, coordinates, deadline=None):
+        """Create routes concurrently.
+
+        :param [(float, float, float, float)] coordinates: (start_latitude, start_longitude,
+            finish_latitude, finish_longitude) list
+        :param float deadline: time.monotonic() deadline, see `deadline`, None waits
+            `route_deadline`
+        :return list: get_ors_route results in the same order, None on ORS error or deadline
+        """
+        return self._map(self.get_ors_route, coordinates, deadline)
+
+    def _map(self, func, args_list, deadline=None):
+        """Call function for every arguments concurrently.
+
+        At most `route_concurrency` calls run at once, calls not completed by the deadline
+        are abandoned.
+
+        :param callable func: function
+        :param [tuple] args_list: positional arguments list
+        :param float deadline: time.monotonic() deadline, None waits `route_deadline`
+        :return list: results in the same order, None for abandoned calls
+        """
+        if len(args_list) <= 1:
+            return [func(*args) for args in args_list]
+        if deadline is None:
+            deadline = self.deadline()
+        tasks = [self._executor.submit(func, *args) for args in args_list]
+        done, not_done = futures.wait(tasks, timeout=max(0, deadline - time.monotonic()))
+        for task in not_done:
+            task.cancel()
+        if not_done:
+            logger.error("ORS deadline exceeded: %s of %s requests", len(not_done), len(tasks))
+        return [task.result() if task in done else None for task in tasks]
+
+    def _get_cached_route(self, key):
+        """Get route from memory cache, then from persistent cache.
+
+        :param tuple key: route cache key
+        :return (Route, float, float): route, duration and
+            distance or None
+        """
+        cached = self.route_cache.get(key)
+        if cached is None and self.persistent_route_cache is not None:
+            value = self.persistent_route_cache.get(self._persistent_key(key))
+            if value:
+                polyline, duration, distance = json.loads(value)
+                cached = (Route.decode(polyline), duration, distance)
+                self.route_cache.put(key, cached)
+        return cached
+
+    def _put_cached_route(self, key, cached):
+        """Put route to memory and persistent caches.
+
+        :param tuple key: route cache key
+        :param (Route, float, float) cached: route, duration
+            and distance
+        """
+        self.route_cache.put(key, cached)
+        if self.persistent_route_cache is not None:
+            route, duration, distance = cached
+            self.persistent_route_cache.put(
+                self._persistent_key(key), json.dumps([route.polyline, duration, distance])
+            )
+
+    def _persistent_key(self, key):
+        """Get persistent route cache key.
+
+        :param tuple key: rounded route coordinates
+        :return str: routing backend, profile and coordinates
+        """
+        return self.cache_namespace + ":" + ",".join(str(c) for c in key)
+
+    @staticmethod
+    def _request(method, *args, **kwargs):
+        """Call openrouteservice client method.
+
+        :param callable method: openrouteservice.Client method
+        :return dict: response or None on error
+        """
         try:
-            data = self.client.directions(coords)
+            return method(*args, **kwargs)
         except exceptions.ApiError as e:
             logger.error("ORS ApiError: %s", e)
         except exceptions.Timeout as e:
             logger.error("ORS Timeout: %s", e)
         except exceptions.HTTPError as e:
             logger.error("ORS HTTPError: %s", e)
-
-        # Skip if received any ORS error.
-        if not data:
-            return None
-        geometry = data["routes"][0]["geometry"]
-        coordinates = convert.decode_polyline(geometry)["coordinates"]
-        routes = {
-            "lon": [c[0] for c in coordinates],
-            "lat": [c[1] for c in coordinates],
-        }
-        summary = {
-            "duration": round(data["routes"][0]["summary"].get("duration", 0) / 60),
-            "distance": round(data["routes"][0]["summary"].get("distance", 0) / 1000, 2),
-        }
-        return routes, summary
+        return None
 
     def create_route_image(self, to_customer_route, ride_route):
         """Create route image.
 
-        :param [dict(lat=float, lon=float})] to_customer_route: route to customer
-        :param [dict(lat=float, lon=float})] ride_route: ride route
+        The image is rendered in background, the url is available right away.
+        Image name is a hash of the routes and image settings, the same routes are rendered once.
+        A reused image and its variants are touched, so the janitor counts retention from
+        the last use. Channel variants are made in the same render task, see `channel_image_url`.
+
+        :param Route to_customer_route: route to customer
+        :param Route ride_route: ride route
         :return str: image url
         """
-        image_name = f"{uuid.uuid4()}.png"
-        image_path = f"{self.upload_image_path}/{image_name}"
+        image_name = _image_name(to_customer_route, ride_route, self.image_settings)
+        path = image_path(self.upload_image_path, image_name)
         image_url = f"{self.image_storage_url}/{image_name}"
-        _save_route_image(to_customer_route, ride_route, image_path)
+        paths = [path, *self._variant_paths(path)]
+        if _touch(paths) or not self.render_queue.submit(
+            image_key(image_name), self._render_image, to_customer_route, ride_route, path
+        ):
+            self.image_hits += 1
+        else:
+            self.image_misses += 1
+        logger.debug(
+            "route image: name=%s hits=%s misses=%s",
+            image_name,
+            self.image_hits,
+            self.image_misses,
+        )
         return image_url
 
+    def channel_image_url(self, image_url, channel):
+        """Get url of the image variant for a messenger channel.
+
+        :param str image_url: image url, see `create_route_image`
+        :param str channel: telegram or viber
+        :return str: variant url or image_url if variants are disabled
+        """
+        if not self.image_variants or channel not in IMAGE_VARIANTS:
+            return image_url
+        return _variant_name(image_url, channel)
+
+    def _variant_paths(self, path):
+        if not self.image_variants:
+            return []
+        return [_variant_name(path, channel) for channel in IMAGE_VARIANTS]
+
+    def _render_image(self, to_customer_route, ride_route, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            if self.image_settings["renderer"] == "pillow":
+                _save_route_image_pillow(
+                    to_customer_route, ride_route, path, self.tile_cache, self.ride_layers
+                )
+            else:
+                _save_route_image(
+                    to_customer_route,
+                    ride_route,
+                    path,
+                    self.renderer_pool,
+                    self.tile_layer_url,
+                    self.tile_cache,
+                )
+            if self.image_variants:
+                variants = {_variant_name(path, c): v for c, v in IMAGE_VARIANTS.items()}
+                map_image.save_variants(path, variants)
+        except Exception:
+            # The image name is reused for the same routes, do not leave a broken image behind.
+            for p in [path, *self._variant_paths(path)]:
+                if os.path.exists(p):
+                    os.remove(p)
+            raise
+
 
 route_client = _RouteClient()
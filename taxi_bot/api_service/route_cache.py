@@ -0,0 +1,289 @@
+"""Route and image caches."""
+import collections
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RouteCache:
+    """Bounded LRU cache of routes with time to live.
+
+    Keys are start and finish coordinates rounded to `precision` decimal places
+    (5 digits is about 1 meter). Values must be immutable, they are shared by all callers.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, precision=5):
+        """Create cache.
+
+        :param int maxsize: Maximum number of routes, 0 disables the cache
+        :param float ttl: Route time to live, seconds
+        :param int precision: Number of decimal places of coordinates in the key
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+
+    def key(self, start_latitude, start_longitude, finish_latitude, finish_longitude):
+        """Get cache key for route.
+
+        :param float start_latitude: start latitude
+        :param float start_longitude: start longitude
+        :param float finish_latitude: finish latitude
+        :param float finish_longitude: finish longitude
+        :return tuple: key
+        """
+        return tuple(
+            round(c, self.precision)
+            for c in (start_latitude, start_longitude, finish_latitude, finish_longitude)
+        )
+
+    def get(self, key):
+        """Get route.
+
+        :param tuple key: See `key` method
+        :return: cached value or None if not found or expired
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item and item[0] < time.monotonic():
+                del self._data[key]
+                item = None
+            if not item:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def peek(self, key):
+        """Get route without updating counters and recency.
+
+        :param tuple key: See `key` method
+        :return: cached value or None if not found or expired
+        """
+        with self._lock:
+            item = self._data.get(key)
+        if not item or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def put(self, key, value):
+        """Put route, evict least recently used routes on overflow.
+
+        :param tuple key: See `key` method
+        :param value: immutable value
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Remove all routes and reset counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        """Get number of cached routes."""
+        return len(self._data)
+
+
+class LruCache:
+    """Bounded LRU cache without expiration, for values which never change."""
+
+    def __init__(self, maxsize=64):
+        """Create cache.
+
+        :param int maxsize: Maximum number of values, 0 disables the cache
+        """
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+
+    def get(self, key):
+        """Get value.
+
+        :param key: key
+        :return: cached value or None if not found
+        """
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Put value, evict least recently used values on overflow.
+
+        :param key: key
+        :param value: value, shared by all callers
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Remove all values."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        """Get number of cached values."""
+        return len(self._data)
+
+
+class PersistentRouteCache:
+    """Route cache stored in a SQLite file, survives service restarts.
+
+    Values are strings, the least recently used routes are evicted when the number of routes
+    exceeds `maxsize`.
+    """
+
+    def __init__(self, path, maxsize=100000, ttl=3600):
+        """Open (create) cache file.
+
+        :param str path: SQLite file path
+        :param int maxsize: Maximum number of routes
+        :param float ttl: Route time to live, seconds
+        """
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS route ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS route_accessed ON route (accessed)")
+        self._size = self._conn.execute("SELECT COUNT(*) FROM route").fetchone()[0]
+        logger.info("persistent route cache: path=%s size=%s", path, self._size)
+
+    def get(self, key):
+        """Get route.
+
+        :param str key: route key
+        :return str: cached value or None if not found or expired
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM route WHERE key = ? AND created > ?", (key, now - self.ttl)
+            ).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE route SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        """Put route, evict least recently used routes on overflow.
+
+        :param str key: route key
+        :param str value: route value
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR REPLACE INTO route (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            # Replaced routes are counted too, the exact size is recounted on eviction.
+            self._size += cursor.rowcount
+            if self._size > self.maxsize:
+                self._evict()
+
+    def _evict(self):
+        self._conn.execute("DELETE FROM route WHERE created <= ?", (time.time() - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM route WHERE key IN "
+            "(SELECT key FROM route ORDER BY accessed LIMIT max(0, (SELECT COUNT(*) FROM route) - ?))",
+            (self.maxsize,),
+        )
+        self._size = self._conn.execute("SELECT COUNT(*) FROM route").fetchone()[0]
+        logger.debug("persistent route cache evicted: size=%s", self._size)
+
+    def clear(self):
+        """Remove all routes and reset counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM route")
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        """Get number of cached routes."""
+        return self._size
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls with the same key.
+
+    The first caller runs the function, callers arriving while it is in flight wait
+    and get the same result (or exception).
+    """
+
+    def __init__(self):
+        """Create empty in-flight calls registry."""
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """Call function once for all concurrent callers with the same key.
+
+        :param key: hashable call key
+        :param callable func: function without arguments
+        :return: function result
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class _Call:
+    """In-flight call of SingleFlight."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
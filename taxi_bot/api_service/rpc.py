@@ -1,27 +1,134 @@
 """Rpc client."""
 
 import logging
+import threading
+import time
 
+from requests.adapters import HTTPAdapter
 from requests_toolbelt.sessions import BaseUrlSession
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
 _HEADERS = {"Content-Type": "application/json"}
+BATCH_MAX_SIZE = 100
+# Batch errors of calls which are retried: skipped after a failed call and internal bot errors.
+# Other errors are final like errors returned for single calls, see `taxi_bot.rpc_batch`.
+BATCH_RETRY_ERROR_CODES = (-32000, -32603)
+
+
+class RpcError(RuntimeError):
+    """Bot returned an error for a batched call or an invalid batch response."""
+
+
+class _PoolWaitAdapter(HTTPAdapter):
+    """HTTP adapter reporting time spent waiting for a free pooled connection.
+
+    The pool blocks when all `pool_maxsize` connections are in use instead of opening
+    connections which are discarded afterwards, the wait is limited by `pool_timeout`.
+    """
+
+    def __init__(self, on_pool_wait, pool_timeout, **kwargs):
+        self._on_pool_wait = on_pool_wait
+        self._pool_timeout = pool_timeout
+        super().__init__(pool_block=True, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: self._timed_pool_class(pool_class)
+            for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def _timed_pool_class(self, pool_class):
+        on_pool_wait, pool_timeout = self._on_pool_wait, self._pool_timeout
+
+        class TimedPool(pool_class):
+            def _get_conn(self, timeout=None):
+                start = time.monotonic()
+                try:
+                    return super()._get_conn(pool_timeout if timeout is None else timeout)
+                finally:
+                    on_pool_wait(time.monotonic() - start)
+
+        return TimedPool
 
 
 class _RpcClient:
     def __init__(self):
         self.driver_session = None
         self.customer_session = None
+        self.timeout = (3, 10)
+        self.batches = 0
+        self.pool_waits = 0
+        self.pool_wait_seconds = 0
+        self.pool_wait_max = 0
+        self._lock = threading.Lock()
 
-    def set_config(self, driver_bot_url, customer_bot_url):
+    def set_config(
+        self,
+        driver_bot_url,
+        customer_bot_url,
+        pool_size=10,
+        connect_timeout=3,
+        read_timeout=10,
+        retries=2,
+        keep_alive=True,
+    ):
         """Set configuration.
 
         :param str driver_bot_url: Driver bot url
         :param str customer_bot_url: Customer bot url
+        :param int pool_size: Maximum number of connections to each bot
+        :param float connect_timeout: Bot connect timeout and free connection wait limit, seconds
+        :param float read_timeout: Bot response timeout, seconds
+        :param int retries: Retries of calls which did not reach the bot
+        :param bool keep_alive: Reuse connections between calls
         """
-        self.driver_session = BaseUrlSession(base_url=driver_bot_url)
-        self.customer_session = BaseUrlSession(base_url=customer_bot_url)
+        self.timeout = (connect_timeout, read_timeout)
+        self.driver_session = self._session(
+            driver_bot_url, pool_size, connect_timeout, retries, keep_alive
+        )
+        self.customer_session = self._session(
+            customer_bot_url, pool_size, connect_timeout, retries, keep_alive
+        )
+
+    def _session(self, base_url, pool_size, pool_timeout, retries, keep_alive):
+        # Rpc calls are POST requests, urllib3 does not retry them after the request is sent,
+        # so only connection errors are retried and a notification is never delivered twice.
+        retry = Retry(total=retries, backoff_factor=0.2, raise_on_status=False)
+        adapter = _PoolWaitAdapter(
+            self._pool_wait,
+            pool_timeout,
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+        session = BaseUrlSession(base_url=base_url)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def _pool_wait(self, seconds):
+        """Add pooled connection wait time to metrics.
+
+        :param float seconds: Wait time
+        """
+        with self._lock:
+            self.pool_wait_seconds += seconds
+            self.pool_wait_max = max(self.pool_wait_max, seconds)
+            if seconds < 0.001:
+                return
+            self.pool_waits += 1
+        logger.debug(
+            "rpc pool wait: wait=%.3f waits=%s total=%.3f max=%.3f",
+            seconds,
+            self.pool_waits,
+            self.pool_wait_seconds,
+            self.pool_wait_max,
+        )
 
     def notify_customer(self, channel, messenger_id, method, params):
         """Notify customer.
@@ -33,10 +140,7 @@ class _RpcClient:
         """
         data = {"method": method, "params": params}
         logger.debug("notify_customer: method=%s, params=%s", method, params)
-        response = self.customer_session.post(
-            url=f"/rpc/{channel}/{messenger_id}", json=data, headers=_HEADERS
-        )
-        response.raise_for_status()
+        self._call(self.customer_session, channel, messenger_id, data)
 
     def notify_driver(self, messenger_id, method, params):
         """Notify driver.
@@ -47,10 +151,50 @@ class _RpcClient:
         """
         data = {"method": method, "params": params}
         logger.debug("notify_driver: method=%s, params=%s", method, params)
-        response = self.driver_session.post(
-            f"/rpc/telegram/{messenger_id}", json=data, headers=_HEADERS
+        self._call(self.driver_session, "telegram", messenger_id, data)
+
+    def notify_customers(self, calls):
+        """Notify customers with one batch request, see `taxi_bot.rpc_batch`.
+
+        :param [(str, str, str, dict)] calls: channel, messenger_id, method and params of each call
+        :return list: error or None for each call
+        """
+        return self._send_batch(self.customer_session, calls)
+
+    def notify_drivers(self, calls):
+        """Notify drivers with one batch request, see `taxi_bot.rpc_batch`.
+
+        :param [(str, str, str, dict)] calls: channel, messenger_id, method and params of each call
+        :return list: error or None for each call
+        """
+        return self._send_batch(self.driver_session, calls)
+
+    def _call(self, session, channel, messenger_id, data):
+        response = session.post(
+            f"/rpc/{channel}/{messenger_id}", json=data, headers=_HEADERS, timeout=self.timeout
         )
         response.raise_for_status()
 
+    def _send_batch(self, session, calls):
+        """Send batch request.
+
+        :param BaseUrlSession session: Bot session
+        :param [(str, str, str, dict)] calls: channel, messenger_id, method and params of each call
+        :return list: error or None for each call
+        """
+        items = [
+            {"channel": channel, "user_id": messenger_id, "method": method, "params": params}
+            for channel, messenger_id, method, params in calls
+        ]
+        with self._lock:
+            self.batches += 1
+        logger.debug("rpc batch: size=%s", len(items))
+        response = session.post("/rpc/batch", json=items, headers=_HEADERS, timeout=self.timeout)
+        response.raise_for_status()
+        results = response.json().get("result")
+        if not isinstance(results, list) or len(results) != len(items):
+            raise RpcError(f"Invalid batch response: {response.text[:200]}")
+        return [result.get("error") for result in results]
+
 
 rpc_client = _RpcClient()
@@ -1,4 +1,6 @@
 """DB schema."""
+import os
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import (
@@ -11,13 +13,29 @@ from sqlalchemy import (
     Integer,
     String,
     UniqueConstraint,
+    make_url,
 )
 
 app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+# The engine is created on import, so the database is set by environment, not by cli options.
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    "TAXI_BOT_DATABASE_URI", "sqlite:///:memory:"
+)
 db = SQLAlchemy(app)
 
 
+def is_memory_database():
+    """Check if the database is in memory.
+
+    An in-memory database is one connection shared by all threads, so threads see and commit
+    uncommitted changes of each other.
+
+    :return bool: True for in-memory database
+    """
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    return url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+
+
 INIT_ORDER_STATE = "init"
 DRIVER_CONFIRM_ORDER_STATE = "confirm"
 DRIVER_ARRIVED_ORDER_STATE = "driver_arrived"
@@ -30,6 +48,9 @@ CONFIRMED_REQUEST_STATE = "confirmed"
 COMPLETED_REQUEST_STATE = "completed"
 CANCELED_REQUEST_STATE = "canceled"
 
+CUSTOMER_BOT = "customer"
+DRIVER_BOT = "driver"
+
 
 class DriverTable(db.Model):
     """Stores the information about a driver."""
@@ -87,6 +108,8 @@ class OrderTable(db.Model):
     finish_latitude = Column(Float, nullable=False)
     finish_longitude = Column(Float, nullable=False)
     driver_id = Column(Integer, ForeignKey("driver.driver_id"))
+    ride_summary = Column(String)
+    ride_polyline = Column(String)
     state = Column(
         Enum(
             INIT_ORDER_STATE,
@@ -199,3 +222,28 @@ class DriverRejectOrderTable(db.Model):
         )
 
     __table_args__ = (UniqueConstraint("driver_id", "order_id"),)
+
+
+class OutboxTable(db.Model):
+    """Stores notifications waiting for delivery to customer and driver bots."""
+
+    __tablename__ = "outbox"
+
+    outbox_id = Column(Integer, primary_key=True)
+    bot = Column(Enum(CUSTOMER_BOT, DRIVER_BOT, name="Bot"), nullable=False)
+    channel = Column(String, nullable=False)
+    messenger_id = Column(String, nullable=False)
+    method = Column(String, nullable=False)
+    params = Column(String, nullable=False)
+    order_id = Column(Integer, ForeignKey("order.order_id"))
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(Float, nullable=False, default=0)
+
+    outbox_recipient_idx = Index("outbox_recipient", messenger_id, bot, channel, outbox_id)
+
+    def __repr__(self):
+        """Representation."""
+        return (
+            f"<Outbox(outbox_id={self.outbox_id!r}, bot={self.bot!r}, channel={self.channel!r}, "
+            f"messenger_id={self.messenger_id!r}, method={self.method!r}, attempts={self.attempts!r})>"
+        )
@@ -0,0 +1,111 @@
+"""Map tile cache."""
+import logging
+import os
+import threading
+
+import requests
+
+from taxi_bot.api_service.route_cache import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+
+
+class TileCache:
+    """Raster map tiles stored in a local directory as `{z}/{x}/{y}.png`.
+
+    Missing tiles are downloaded from `upstream_url`, the least recently used tiles are removed
+    when the directory grows over `max_bytes`. Without `upstream_url` the directory is used
+    as is, for example with tiles prepared in advance for the service city.
+    Public tile servers require a User-Agent identifying the application and its operator,
+    see https://operations.osmfoundation.org/policies/tiles/.
+    """
+
+    def __init__(
+        self, path, upstream_url=None, max_bytes=500_000_000, timeout=10, user_agent=None
+    ):
+        """Create cache.
+
+        :param str path: Tile directory
+        :param str upstream_url: Tile server url template with {z}, {x} and {y}, None disables downloads
+        :param int max_bytes: Maximum directory size, bytes
+        :param float timeout: Tile download timeout, seconds
+        :param str user_agent: User-Agent of tile downloads with a contact, required with upstream_url
+        :raise ValueError: upstream_url without user_agent
+        """
+        if upstream_url and not user_agent:
+            raise ValueError("Tile downloads require a User-Agent with a contact")
+        self.path = path
+        self.upstream_url = upstream_url
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = user_agent
+        self._size = sum(size for _, size, _ in self._files())
+        logger.info("tile cache: path=%s size=%s", path, self._size)
+
+    def get(self, zoom, x, y, download=True):
+        """Get tile.
+
+        :param int zoom: Tile zoom
+        :param int x: Tile column
+        :param int y: Tile row
+        :param bool download: Download a missing tile from upstream_url
+        :return bytes: PNG image or None if the tile is not available
+        """
+        path = os.path.join(self.path, str(zoom), str(x), f"{y}.png")
+        try:
+            with open(path, "rb") as f:
+                tile = f.read()
+            # Modification time is the last access time for eviction.
+            os.utime(path)
+            self.hits += 1
+            return tile
+        except FileNotFoundError:
+            pass
+        self.misses += 1
+        if not self.upstream_url or not download:
+            return None
+        return self._single_flight.do(path, lambda: self._download(path, zoom, x, y))
+
+    def _download(self, path, zoom, x, y):
+        url = self.upstream_url.format(z=zoom, x=x, y=y)
+        try:
+            response = self._session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.error("tile download failed: %s", e)
+            return None
+        tile = response.content
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(tile)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._size += len(tile)
+            if self._size > self.max_bytes:
+                self._evict()
+        return tile
+
+    def _evict(self):
+        files = sorted(self._files())
+        # Free a tenth of the budget at once so eviction does not run on every download.
+        while files and self._size > self.max_bytes * 0.9:
+            _, size, path = files.pop(0)
+            os.remove(path)
+            self._size -= size
+        logger.debug("tile cache evicted: size=%s", self._size)
+
+    def _files(self):
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if name.endswith(".png"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    yield stat.st_mtime, stat.st_size, path
@@ -9,14 +9,19 @@ from taxi_bot.api_service import (  # noqa: F401, pylint: disable=unused-import
     common,
     customer,
     driver,
+    query,
 )
+from taxi_bot.api_service.geo_index import driver_index
+from taxi_bot.api_service.janitor import image_janitor
+from taxi_bot.api_service.outbox import outbox_dispatcher
 from taxi_bot.api_service.route import route_client
 from taxi_bot.api_service.rpc import rpc_client
-from taxi_bot.api_service.schema import app, db
+from taxi_bot.api_service.schema import app, db, is_memory_database
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
+logger = logging.getLogger(__name__)
 
 
 @click.command()
@@ -33,8 +38,7 @@ logging.basicConfig(
     "--openrouteservice-token",
     "openrouteservice_token",
     type=str,
-    required=True,
-    help="Openrouteservice service token",
+    help="Openrouteservice service token, required without --osm-file",
 )
 @click.option(
     "--upload-file-path",
@@ -50,6 +54,243 @@ logging.basicConfig(
     required=True,
     help="Image storage url",
 )
+@click.option(
+    "--route-cache-size",
+    "route_cache_size",
+    type=int,
+    default=1024,
+    show_default=True,
+    help="Maximum number of cached routes, 0 disables the cache",
+)
+@click.option(
+    "--route-cache-ttl",
+    "route_cache_ttl",
+    type=float,
+    default=3600,
+    show_default=True,
+    help="Cached route time to live, seconds",
+)
+@click.option(
+    "--route-cache-precision",
+    "route_cache_precision",
+    type=int,
+    default=5,
+    show_default=True,
+    help="Number of decimal places of cached route coordinates",
+)
+@click.option(
+    "--route-cache-path",
+    "route_cache_path",
+    type=click.Path(dir_okay=False),
+    help="SQLite file of persistent route cache, disabled by default",
+)
+@click.option(
+    "--route-cache-file-size",
+    "route_cache_file_size",
+    type=int,
+    default=100000,
+    show_default=True,
+    help="Maximum number of routes in persistent route cache",
+)
+@click.option(
+    "--route-cache-file-ttl",
+    "route_cache_file_ttl",
+    type=float,
+    default=604800,
+    show_default=True,
+    help="Time to live of a route in persistent route cache, seconds",
+)
+@click.option(
+    "--osm-file",
+    "osm_file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="OpenStreetMap XML extract (.osm) for offline routing instead of openrouteservice",
+)
+@click.option(
+    "--route-concurrency",
+    "route_concurrency",
+    type=int,
+    default=8,
+    show_default=True,
+    help="Maximum number of concurrent routing requests",
+)
+@click.option(
+    "--route-deadline",
+    "route_deadline",
+    type=float,
+    default=30,
+    show_default=True,
+    help="Maximum time to wait for concurrent routing requests of one API request, seconds",
+)
+@click.option(
+    "--render-workers",
+    "render_workers",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of background route image rendering threads",
+)
+@click.option(
+    "--renderer-processes",
+    "renderer_processes",
+    type=int,
+    default=0,
+    show_default=True,
+    help="Number of warm kaleido renderer processes, 0 renders in rendering threads",
+)
+@click.option(
+    "--image-renderer",
+    "image_renderer",
+    type=click.Choice(["plotly", "pillow"]),
+    default="plotly",
+    show_default=True,
+    help="Route image renderer, pillow draws routes without chromium",
+)
+@click.option(
+    "--tile-cache-path",
+    "tile_cache_path",
+    type=click.Path(file_okay=False),
+    help="Local map tile directory used by route images, tiles are downloaded on every render by default",
+)
+@click.option(
+    "--tile-url",
+    "tile_url",
+    help="Tile server url template for tiles missing in the tile directory, local tiles only by default",
+)
+@click.option(
+    "--tile-user-agent",
+    "tile_user_agent",
+    help="User-Agent of tile downloads naming the service and its contact, required with --tile-url",
+)
+@click.option(
+    "--tile-cache-bytes",
+    "tile_cache_bytes",
+    type=int,
+    default=500_000_000,
+    show_default=True,
+    help="Maximum tile directory size, bytes",
+)
+@click.option(
+    "--route-simplify-tolerance",
+    "route_simplify_tolerance",
+    type=float,
+    default=1,
+    show_default=True,
+    help="Maximum route simplification error, route image pixels, 0 keeps all route points",
+)
+@click.option(
+    "--image-cache-size",
+    "image_cache_size",
+    type=int,
+    default=64,
+    show_default=True,
+    help="Number of recently downloaded route images kept in memory, 0 disables",
+)
+@click.option(
+    "--image-accel-redirect",
+    "image_accel_redirect",
+    help="nginx internal location of upload_file_path, images are sent by nginx with X-Accel-Redirect",
+)
+@click.option(
+    "--image-retention",
+    "image_retention",
+    type=float,
+    default=86400,
+    show_default=True,
+    help="Route images not used by active driver requests are removed after this time, seconds",
+)
+@click.option(
+    "--image-storage-bytes",
+    "image_storage_bytes",
+    type=int,
+    default=1_000_000_000,
+    show_default=True,
+    help="Maximum size of route images, the oldest unused images are removed first, 0 disables",
+)
+@click.option(
+    "--image-variants",
+    "image_variants",
+    is_flag=True,
+    help="Send smaller route image encodings made for each messenger channel, requires Pillow",
+)
+@click.option(
+    "--notify-attempts",
+    "notify_attempts",
+    type=int,
+    default=10,
+    show_default=True,
+    help="Bot notification delivery attempts before the notification is dropped",
+)
+@click.option(
+    "--notify-retry-delay",
+    "notify_retry_delay",
+    type=float,
+    default=1,
+    show_default=True,
+    help="Delay after the first failed bot notification delivery, doubled on every attempt, seconds",
+)
+@click.option(
+    "--notify-max-retry-delay",
+    "notify_max_retry_delay",
+    type=float,
+    default=300,
+    show_default=True,
+    help="Maximum delay between bot notification delivery attempts, seconds",
+)
+@click.option(
+    "--notify-workers",
+    "notify_workers",
+    type=int,
+    default=8,
+    show_default=True,
+    help="Maximum number of customers and drivers notified concurrently",
+)
+@click.option(
+    "--notify-batch/--no-notify-batch",
+    "notify_batch",
+    default=False,
+    show_default=True,
+    help="Send due notifications to each bot in one /rpc/batch request",
+)
+@click.option(
+    "--rpc-pool-size",
+    "rpc_pool_size",
+    type=int,
+    default=10,
+    show_default=True,
+    help="Maximum number of connections to each bot, calls wait for a free connection",
+)
+@click.option(
+    "--rpc-connect-timeout",
+    "rpc_connect_timeout",
+    type=float,
+    default=3,
+    show_default=True,
+    help="Bot connect timeout and maximum wait for a free connection, seconds",
+)
+@click.option(
+    "--rpc-read-timeout",
+    "rpc_read_timeout",
+    type=float,
+    default=10,
+    show_default=True,
+    help="Bot response timeout, seconds",
+)
+@click.option(
+    "--rpc-retries",
+    "rpc_retries",
+    type=int,
+    default=2,
+    show_default=True,
+    help="Retries of bot calls failed to connect, calls are not repeated once sent",
+)
+@click.option(
+    "--rpc-keep-alive/--no-rpc-keep-alive",
+    "rpc_keep_alive",
+    default=True,
+    show_default=True,
+    help="Reuse connections to bots between calls",
+)
 @click_config_file.configuration_option()
 def main(
     bind_port,
@@ -58,16 +299,105 @@ def main(
     openrouteservice_token,
     upload_file_path,
     image_storage_url,
+    route_cache_size,
+    route_cache_ttl,
+    route_cache_precision,
+    route_cache_path,
+    route_cache_file_size,
+    route_cache_file_ttl,
+    osm_file,
+    route_concurrency,
+    route_deadline,
+    render_workers,
+    renderer_processes,
+    image_renderer,
+    tile_cache_path,
+    tile_url,
+    tile_user_agent,
+    tile_cache_bytes,
+    route_simplify_tolerance,
+    image_cache_size,
+    image_accel_redirect,
+    image_retention,
+    image_storage_bytes,
+    image_variants,
+    notify_attempts,
+    notify_retry_delay,
+    notify_max_retry_delay,
+    notify_workers,
+    notify_batch,
+    rpc_pool_size,
+    rpc_connect_timeout,
+    rpc_read_timeout,
+    rpc_retries,
+    rpc_keep_alive,
 ):
     """Run taxi_bot applications.
 
     Provides command to run taxi_bot
     """
-    rpc_client.set_config(driver_bot_url, customer_bot_url)
+    if not openrouteservice_token and not osm_file:
+        raise click.UsageError("Missing option '--openrouteservice-token' or '--osm-file'.")
+    if tile_cache_path and tile_url and not tile_user_agent:
+        raise click.UsageError("Missing option '--tile-user-agent' required by '--tile-url'.")
+    rpc_client.set_config(
+        driver_bot_url=driver_bot_url,
+        customer_bot_url=customer_bot_url,
+        pool_size=rpc_pool_size,
+        connect_timeout=rpc_connect_timeout,
+        read_timeout=rpc_read_timeout,
+        retries=rpc_retries,
+        keep_alive=rpc_keep_alive,
+    )
     route_client.set_config(
-        upload_file_path, f"{image_storage_url}/images", openrouteservice_token
+        upload_image_path=upload_file_path,
+        image_storage_url=f"{image_storage_url}/images",
+        open_route_service_key=openrouteservice_token,
+        route_cache_size=route_cache_size,
+        route_cache_ttl=route_cache_ttl,
+        route_cache_precision=route_cache_precision,
+        route_cache_path=route_cache_path,
+        route_cache_file_size=route_cache_file_size,
+        route_cache_file_ttl=route_cache_file_ttl,
+        osm_path=osm_file,
+        route_concurrency=route_concurrency,
+        route_deadline=route_deadline,
+        render_workers=render_workers,
+        renderer_processes=renderer_processes,
+        image_renderer=image_renderer,
+        tile_cache_path=tile_cache_path,
+        tile_url=tile_url,
+        tile_user_agent=tile_user_agent,
+        tile_cache_bytes=tile_cache_bytes,
+        tile_layer_url=f"{image_storage_url}/tiles/{{z}}/{{x}}/{{y}}.png",
+        route_simplify_tolerance=route_simplify_tolerance,
+        image_cache_size=image_cache_size,
+        image_variants=image_variants,
     )
     with app.app_context():
         app.config["UPLOAD_FOLDER"] = upload_file_path
+        app.config["IMAGE_ACCEL_REDIRECT"] = image_accel_redirect
         db.create_all()
+        driver_index.load(query.find_all_driver_requests())
+        outbox_dispatcher.set_config(
+            max_attempts=notify_attempts,
+            retry_delay=notify_retry_delay,
+            max_retry_delay=notify_max_retry_delay,
+            workers=notify_workers,
+            batch=notify_batch,
+        )
+        if is_memory_database():
+            # Background threads would share the connection of API requests.
+            logger.warning("in-memory database: notifications are delivered by API requests")
+            logger.warning("in-memory database: route images are not removed")
+        else:
+            outbox_dispatcher.start()
+            image_janitor.start(
+                upload_file_path, _active_images, image_retention, image_storage_bytes
+            )
         app.run(port=bind_port)
+
+
+def _active_images():
+    with app.app_context():
+        return [url.rsplit("/", 1)[-1] for url in query.find_active_image_urls()]
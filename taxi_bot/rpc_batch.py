@@ -0,0 +1,84 @@
+"""Batches of bot rpc requests."""
+
+import asyncio
+import logging
+
+from maxbot.rpc import RpcError
+
+logger = logging.getLogger(__name__)
+
+# Items of a user after a failed one are not processed to keep notifications in order.
+SKIPPED_ERROR_CODE = -32000
+INTERNAL_ERROR_CODE = -32603
+
+
+def blueprint(channels, callback):
+    """Create web application blueprint to receive batches of rpc requests at `/rpc/batch`.
+
+    A batch is a list of `{"channel": ..., "user_id": ..., "method": ..., "params": ...}`,
+    the response contains `{"result": null}` or `{"error": ...}` for every request in the same
+    order. Requests are passed to the rpc callback like `/rpc/<channel>/<user_id>` requests,
+    requests of one user in order and requests of different users concurrently.
+    Rpc errors are returned like for single requests. After a request failed with
+    INTERNAL_ERROR_CODE the next requests of the same user are skipped with
+    SKIPPED_ERROR_CODE, so the caller retries them in order. A body which is not a list
+    is rejected with a single "Invalid Request" error.
+
+    :param ChannelsCollection channels: Channels to respond
+    :param callable callback: Rpc callback of the bot, `MaxBot.default_rpc_adapter`
+    :return Blueprint: Blueprint for sanic app
+    """
+    # lazy import like maxbot
+    from sanic import Blueprint
+    from sanic.response import json
+
+    bp = Blueprint("rpc_batch")
+
+    async def call(item):
+        if not isinstance(item, dict) or "user_id" not in item:
+            raise RpcError("Invalid Request", -32600, item)
+        channel = channels.get(item.get("channel"))
+        if channel is None:
+            raise RpcError("Unknown channel", -32100, item.get("channel"))
+        request = {"method": item.get("method"), "params": item.get("params", {})}
+        await callback(request, channel, item["user_id"])
+
+    async def call_user(items):
+        results = []
+        failed = False
+        for index, item in items:
+            if failed:
+                results.append((index, _error(SKIPPED_ERROR_CODE, "Skipped", "previous error")))
+                continue
+            try:
+                await call(item)
+            except RpcError as exc:
+                results.append((index, _error(exc.code, exc.message, exc.data)))
+            except Exception:
+                logger.exception("rpc batch item failed")
+                results.append((index, _error(INTERNAL_ERROR_CODE, "Internal error", None)))
+                failed = True
+            else:
+                results.append((index, {"result": None}))
+        return results
+
+    @bp.post("/rpc/batch")
+    async def batch_endpoint(request):
+        body = request.json
+        if not isinstance(body, list):
+            return json(_error(-32600, "Invalid Request", "batch must be a list"))
+        users = {}
+        for index, item in enumerate(body):
+            key = (item.get("channel"), item.get("user_id")) if isinstance(item, dict) else index
+            users.setdefault(key, []).append((index, item))
+        results = [None] * len(body)
+        for user_results in await asyncio.gather(*map(call_user, users.values())):
+            for index, result in user_results:
+                results[index] = result
+        return json({"result": results})
+
+    return bp
+
+
+def _error(code, message, data):
+    return {"error": {"code": code, "message": message, "data": data}}
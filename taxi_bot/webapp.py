@@ -0,0 +1,61 @@
+"""Bot web application runner."""
+
+import logging
+import os
+
+import click
+
+from . import rpc_batch
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+
+def create_webapp(bot, name, public_url=None):
+    """Create web application of the bot.
+
+    The application is the one of `MaxBot.run_webapp` with the `/rpc/batch` endpoint
+    of `taxi_bot.rpc_batch` next to the rpc endpoint of the bot.
+
+    :param MaxBot bot: Bot
+    :param str name: Application name
+    :param str public_url: Base url to register webhooks
+    :return Sanic: Web application
+    """
+    # lazy import like maxbot
+    import sanic
+
+    app = sanic.Sanic(name, configure_logging=False)
+    app.config.FALLBACK_ERROR_FORMAT = "text"
+    for channel in bot.channels:
+        app.blueprint(
+            channel.blueprint(
+                bot.default_channel_adapter,
+                public_url=public_url,
+                webhook_path=f"/{channel.name}",
+            )
+        )
+    app.blueprint(bot.rpc.blueprint(bot.channels, bot.default_rpc_adapter))
+    app.blueprint(rpc_batch.blueprint(bot.channels, bot.default_rpc_adapter))
+    return app
+
+
+@click.command()
+@click.option(
+    "--bot", "bot_name", type=click.Choice(["customer", "driver"]), required=True, help="Bot"
+)
+@click.option("--host", "host", type=str, default="localhost", help="Bind host")
+@click.option("--port", "port", type=int, default=8080, help="Bind port")
+@click.option("--public-url", "public_url", type=str, required=True, help="Bot public url")
+def main(bot_name, host, port, public_url):
+    """Run the bot with webhooks updater.
+
+    Like `maxbot run --updater=webhooks`, the bot also accepts batches of rpc requests.
+    """
+    # bots are created on import
+    from . import bot
+
+    app = create_webapp(getattr(bot, bot_name), f"taxi_bot_{bot_name}", public_url)
+    os.environ["SANIC_IGNORE_PRODUCTION_WARNING"] = "true"
+    app.run(host, port, motd=False, single_process=True)
@@ -7,12 +7,11 @@ from test_utils import (
     CUSTOMER_LOCATIONS,
     DRIVER_BOT_URL,
     DRIVER_LOCATION,
-    ORS_BODY,
-    ORS_URL,
     client,
     customer,
     delete_ors_keys,
     driver,
+    register_ors,
 )
 
 
@@ -34,11 +33,7 @@ def test_customer_cancel(client, customer, driver, monkeypatch):
     data = {"order_id": order_id_1}
     resp = client.post(f"/customer/{customer['id']}/cancel", json=data)
     assert resp.status_code == 200
-    httpretty.register_uri(
-        httpretty.POST,
-        f"{ORS_URL}",
-        body=json.dumps(ORS_BODY),
-    )
+    register_ors()
     driver_location = dict(location=DRIVER_LOCATION, radius=3)
     resp = client.post(f"/driver/{driver['id']}/request", json=driver_location)
     assert resp.status_code == 200 and not resp.json
@@ -115,11 +110,7 @@ def test_driver_cancel(client, customer, driver, monkeypatch):
     monkeypatch.setattr(go.Figure, "write_image", lambda self, path: True)
     resp = client.post(f"/driver/{driver['id']}/cancel")
     assert 404 == resp.status_code and resp.json["detail"] == "Driver request not found"
-    httpretty.register_uri(
-        httpretty.POST,
-        f"{ORS_URL}",
-        body=json.dumps(ORS_BODY),
-    )
+    register_ors()
     driver_location = dict(location=DRIVER_LOCATION, radius=3)
     resp = client.post(f"/driver/{driver['id']}/request", json=driver_location)
     assert resp.status_code == 200 and not resp.json
@@ -7,12 +7,11 @@ from test_utils import (
     CUSTOMER_LOCATIONS,
     DRIVER_BOT_URL,
     DRIVER_LOCATION,
-    ORS_BODY,
-    ORS_URL,
     client,
     customer,
     delete_ors_keys,
     driver,
+    register_ors,
 )
 
 CUSTOMER_2_LOCATIONS = {
@@ -34,11 +33,7 @@ def test_full_ride_order_first(client, customer, driver, monkeypatch):
     )
     resp = client.post(f"/customer/{customer['id']}/order", json=CUSTOMER_LOCATIONS)
     assert resp.status_code == 200
-    httpretty.register_uri(
-        httpretty.POST,
-        f"{ORS_URL}",
-        body=json.dumps(ORS_BODY),
-    )
+    register_ors()
     driver_location = {"location": DRIVER_LOCATION, "radius": 5}
     resp = client.post(f"/driver/{driver['id']}/request", json=driver_location)
     assert resp.status_code == 200
@@ -115,11 +110,7 @@ def test_full_ride_request_first(client, customer, driver, monkeypatch):
     httpretty.register_uri(
         httpretty.POST, f"{CUSTOMER_BOT_URL}/rpc/telegram/{customer['messenger_id']}"
     )
-    httpretty.register_uri(
-        httpretty.POST,
-        f"{ORS_URL}",
-        body=json.dumps(ORS_BODY),
-    )
+    register_ors()
     resp = client.post(f"/customer/{customer['id']}/order", json=CUSTOMER_LOCATIONS)
     assert resp.status_code == 200 and resp.json.get("order_id")
     body = json.loads(httpretty.latest_requests()[-1].body)
@@ -0,0 +1,35 @@
+from collections import namedtuple
+
+from taxi_bot.api_service.geo_index import _DriverIndex
+
+DriverRequest = namedtuple("DriverRequest", "driver_id latitude longitude radius")
+
+
+def test_find_nearby():
+    index = _DriverIndex()
+    index.add(1, 13.749069, 100.503581, 3)
+    index.add(2, 13.80, 100.55, 10)
+    index.add(3, 13.80, 100.55, 1)
+    index.add(4, 59.921135, 38.317834, 300)
+    assert index.find_nearby(13.749079, 100.503572) == [1, 2]
+    assert index.find_nearby(59.0, 38.0) == [4]
+    assert index.find_nearby(0, 0) == []
+
+
+def test_move_and_remove():
+    index = _DriverIndex()
+    index.add(1, 13.749069, 100.503581, 3)
+    index.add(1, 59.921135, 38.317834, 3)
+    assert index.find_nearby(13.749079, 100.503572) == []
+    assert index.find_nearby(59.921135, 38.317834) == [1]
+    index.remove(1)
+    index.remove(1)
+    assert index.find_nearby(59.921135, 38.317834) == []
+
+
+def test_load():
+    index = _DriverIndex(cell_size=0.01)
+    index.add(5, 0, 0, 300)
+    index.load([DriverRequest(1, 13.749069, 100.503581, 300), DriverRequest(2, 14.5, 101.0, 300)])
+    assert index.find_nearby(0, 0) == []
+    assert index.find_nearby(13.749079, 100.503572) == [1, 2]
@@ -0,0 +1,42 @@
+import random
+
+import pytest
+from openrouteservice import convert
+from test_utils import ORS_BODY
+
+from taxi_bot.api_service.geometry import Route, encode_polyline
+
+
+def test_decode():
+    random.seed(1)
+    coordinates = [
+        (100.5 + random.uniform(-2, 2), 13.7 + random.uniform(-2, 2)) for _ in range(500)
+    ]
+    for polyline in (ORS_BODY["routes"][0]["geometry"], encode_polyline(coordinates), ""):
+        route = Route.decode(polyline)
+        expected = convert.decode_polyline(polyline)["coordinates"]
+        assert list(zip(route.lon, route.lat)) == [tuple(c) for c in expected]
+        assert route.polyline == polyline
+
+
+def test_bounding_box():
+    route = Route(lon=[100.5, 100.7, 100.6], lat=[13.8, 13.7, 13.9])
+    assert (route.min_lat, route.max_lat, route.min_lon, route.max_lon) == (
+        13.7,
+        13.9,
+        100.5,
+        100.7,
+    )
+    assert route == Route.decode(route.polyline)
+    assert Route([], []).min_lat is None
+
+
+def test_read_only():
+    route = Route(lon=[100.5, 100.7], lat=[13.8, 13.7])
+    with pytest.raises(TypeError):
+        route.lat[0] = 0
+    with pytest.raises(AttributeError):
+        route.polyline = ""
+    with pytest.raises(AttributeError):
+        del route.min_lat
+    assert route == Route(route.lon, route.lat)
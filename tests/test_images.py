@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+
+import plotly.graph_objects as go
+from test_utils import client
+
+from taxi_bot.api_service import common
+from taxi_bot.api_service.geometry import Route
+from taxi_bot.api_service.route import route_client
+from taxi_bot.api_service.route_cache import LruCache
+from taxi_bot.api_service.schema import app
+
+NAME = "ab" + "c" * 62
+UNKNOWN = "d" * 64
+
+
+def test_download_waits_for_render(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.setattr(common, "IMAGE_WAIT_TIMEOUT", 0.1)
+    release = threading.Event()
+
+    def render(path):
+        release.wait(5)
+        with open(path, "wb") as f:
+            f.write(b"png")
+
+    (tmp_path / "ab").mkdir()
+    route_client.render_queue.submit(NAME, render, str(tmp_path / "ab" / f"{NAME}.png"))
+    resp = client.get(f"/images/{NAME}.png")
+    assert resp.status_code == 503 and resp.headers["Retry-After"] == "1"
+    release.set()
+    monkeypatch.setattr(common, "IMAGE_WAIT_TIMEOUT", 5)
+    resp = client.get(f"/images/{NAME}.png")
+    assert resp.status_code == 200 and resp.data == b"png"
+    assert client.get(f"/images/{UNKNOWN}.png").status_code == 404
+
+
+def test_route_image_deduplication(client, tmp_path, monkeypatch):
+    renders = []
+
+    def write_image(self, path):
+        renders.append(path)
+        with open(path, "wb") as f:
+            f.write(b"png")
+
+    monkeypatch.setattr(go.Figure, "write_image", write_image)
+    monkeypatch.setattr(route_client, "upload_image_path", str(tmp_path))
+    monkeypatch.setattr(route_client, "image_hits", 0)
+    monkeypatch.setattr(route_client, "image_misses", 0)
+    to_customer = Route(lon=(100.0, 100.1), lat=(13.0, 13.1))
+    ride = Route(lon=(100.1, 100.2), lat=(13.1, 13.2))
+    url = route_client.create_route_image(to_customer, ride)
+    route_client.render_queue.join()
+    os.utime(renders[0], (0, 0))
+    assert route_client.create_route_image(Route(to_customer.lon, to_customer.lat), ride) == url
+    # The reused image is kept by the janitor for the whole retention again.
+    assert os.stat(renders[0]).st_mtime > time.time() - 60
+    assert route_client.create_route_image(ride, to_customer) != url
+    route_client.render_queue.join()
+    assert len(renders) == 2
+    assert (route_client.image_hits, route_client.image_misses) == (1, 2)
+
+
+def test_download_caching_headers(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOAD_FOLDER", str(tmp_path))
+    (tmp_path / "ab").mkdir()
+    (tmp_path / "ab" / f"{NAME}.png").write_bytes(b"png")
+    for cache_size in (0, 4):
+        monkeypatch.setattr(route_client, "image_cache", LruCache(cache_size))
+        resp = client.get(f"/images/{NAME}.png")
+        assert resp.status_code == 200 and resp.data == b"png"
+        assert resp.headers["ETag"] == f'"{NAME}"' and resp.headers["Last-Modified"]
+        assert "immutable" in resp.headers["Cache-Control"]
+        assert resp.cache_control.max_age == common.IMAGE_MAX_AGE
+        resp = client.get(f"/images/{NAME}.png", headers={"If-None-Match": f'"{NAME}"'})
+        assert resp.status_code == 304
+
+    # The image is served from memory.
+    (tmp_path / "ab" / f"{NAME}.png").unlink()
+    assert client.get(f"/images/{NAME}.png").data == b"png"
+    assert client.get(f"/images/{UNKNOWN}.png").status_code == 404
+
+
+def test_download_accel_redirect(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.setitem(app.config, "IMAGE_ACCEL_REDIRECT", "/internal-images")
+    (tmp_path / "ab").mkdir()
+    (tmp_path / "ab" / f"{NAME}.png").write_bytes(b"png")
+    resp = client.get(f"/images/{NAME}.png")
+    assert resp.status_code == 200 and resp.data == b""
+    assert resp.headers["X-Accel-Redirect"] == f"/internal-images/ab/{NAME}.png"
+    assert resp.headers["ETag"] == f'"{NAME}"'
+    assert client.get(f"/images/{UNKNOWN}.png").status_code == 404
+
+
+def test_download_invalid_name(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOAD_FOLDER", str(tmp_path / "images"))
+    (tmp_path / "secret.png").write_bytes(b"secret")
+    (tmp_path / "images").mkdir()
+    for name in ("..", "..%2Fsecret.png", "%2E%2E", f"{NAME}.png%00", f"{NAME.upper()}.png"):
+        assert client.get(f"/images/{name}").status_code == 404
@@ -0,0 +1,37 @@
+import os
+import time
+
+from taxi_bot.api_service.janitor import ImageJanitor, image_path
+
+
+def _image(directory, name, age, size=10):
+    path = image_path(str(directory), name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_clean(tmp_path):
+    old = _image(tmp_path, "aa1.png", 100)
+    old_active = _image(tmp_path, "aa2.png", 100)
+    old_active_variant = _image(tmp_path, "aa2.viber.jpg", 100)
+    new = [_image(tmp_path, f"b{i}.png", 10 - i) for i in range(4)]
+    (tmp_path / "other.txt").write_text("keep")
+    janitor = ImageJanitor()
+    janitor.start(tmp_path, lambda: ["aa2.png"], retention=50, max_bytes=0, interval=3600)
+    janitor.stop()
+    assert janitor.clean() == 1
+    assert not os.path.exists(old) and os.path.exists(old_active)
+    assert os.path.exists(old_active_variant)
+    assert all(os.path.exists(path) for path in new)
+
+    # 6 images of 10 bytes exceed the budget, the oldest unused ones are removed.
+    janitor.max_bytes = 40
+    assert janitor.clean() == 2
+    assert os.path.exists(old_active)
+    assert [os.path.exists(path) for path in new] == [False, False, True, True]
+    assert janitor.removed == 3
+    assert (tmp_path / "other.txt").exists()
@@ -0,0 +1,146 @@
+import heapq
+import math
+import random
+
+import pytest
+from openrouteservice import convert, exceptions
+
+from taxi_bot.api_service.local_routing import LocalRoutingClient, encode_polyline
+
+GRID = 6
+STEP = 0.002
+
+
+def _osm_xml():
+    """Grid of residential streets, every third street is one-way."""
+    nodes = [
+        f'<node id="{i * GRID + j + 1}" lat="{13.7 + i * STEP}" lon="{100.5 + j * STEP}"/>'
+        for i in range(GRID)
+        for j in range(GRID)
+    ]
+    ways = []
+    for i in range(GRID):
+        for refs in (
+            [i * GRID + j + 1 for j in range(GRID)],
+            [j * GRID + i + 1 for j in range(GRID)],
+        ):
+            tags = '<tag k="highway" v="residential"/>'
+            if len(ways) % 3 == 0:
+                tags += '<tag k="oneway" v="yes"/>'
+            if len(ways) % 4 == 1:
+                tags += '<tag k="maxspeed" v="60"/>'
+            nds = "".join(f'<nd ref="{r}"/>' for r in refs)
+            ways.append(f'<way id="{len(ways) + 1}">{nds}{tags}</way>')
+    ways.append('<way id="100"><nd ref="1"/><nd ref="36"/><tag k="highway" v="footway"/></way>')
+    return f'<osm version="0.6">{"".join(nodes)}{"".join(ways)}</osm>'
+
+
+@pytest.fixture
+def router(tmp_path):
+    path = tmp_path / "grid.osm"
+    path.write_text(_osm_xml())
+    return LocalRoutingClient(str(path))
+
+
+def _dijkstra(router, source):
+    # Plain Dijkstra over original edges only.
+    out = [{} for _ in router.coords]
+    for u, edges in enumerate(router._up):
+        out[u].update((w, data) for w, data in edges.items() if data[2] < 0)
+    for w, edges in enumerate(router._down):
+        for u, data in edges.items():
+            if data[2] < 0:
+                out[u][w] = data
+    durations = {source: 0}
+    heap = [(0, source)]
+    while heap:
+        duration, u = heapq.heappop(heap)
+        if duration > durations[u]:
+            continue
+        for v, (edge_duration, _, _) in out[u].items():
+            if duration + edge_duration < durations.get(v, math.inf):
+                durations[v] = duration + edge_duration
+                heapq.heappush(heap, (durations[v], v))
+    return durations
+
+
+def test_encode_polyline():
+    coordinates = [[100.503572, 13.749079], [100.5, 13.7], [-0.12345, -51.5]]
+    assert convert.decode_polyline(encode_polyline(coordinates))["coordinates"] == [
+        [100.50357, 13.74908],
+        [100.5, 13.7],
+        [-0.12345, -51.5],
+    ]
+
+
+def test_directions_match_dijkstra(router):
+    random.seed(1)
+    for _ in range(30):
+        s, t = random.randrange(len(router.coords)), random.randrange(len(router.coords))
+        expected = _dijkstra(router, s).get(t)
+        coords = [router.coords[v][::-1] for v in (s, t)]
+        data = router.directions(coords)
+        summary = data["routes"][0]["summary"]
+        assert summary["duration"] == pytest.approx(expected)
+        geometry = convert.decode_polyline(data["routes"][0]["geometry"])["coordinates"]
+        assert geometry[0] == pytest.approx(coords[0], abs=1e-5)
+        assert geometry[-1] == pytest.approx(coords[1], abs=1e-5)
+        assert summary["distance"] >= 0
+
+
+def test_distance_matrix(router):
+    locations = [(100.5, 13.7), (100.51, 13.71), (100.502, 13.708)]
+    data = router.distance_matrix(locations, sources=[0], destinations=[1, 2])
+    for i, destination in enumerate((1, 2)):
+        summary = router.directions([locations[0], locations[destination]])["routes"][0]["summary"]
+        assert data["durations"][0][i] == pytest.approx(summary["duration"])
+        assert data["distances"][0][i] == pytest.approx(summary["distance"])
+
+
+def test_no_road(router):
+    with pytest.raises(exceptions.ApiError):
+        router.directions([(0, 0), (100.5, 13.7)])
+
+
+def test_shape_points(tmp_path):
+    # Junction 1 - 4 shape points - junction 6, and a side street 6 - 7.
+    nodes = "".join(
+        f'<node id="{i}" lat="{13.7 + i * 0.001}" lon="{100.5 + (i % 2) * 0.0005}"/>'
+        for i in range(1, 8)
+    )
+    ways = (
+        '<way id="1"><nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="4"/><nd ref="5"/>'
+        '<nd ref="6"/><tag k="highway" v="residential"/></way>'
+        '<way id="2"><nd ref="6"/><nd ref="7"/><tag k="highway" v="residential"/></way>'
+    )
+    path = tmp_path / "street.osm"
+    path.write_text(f'<osm version="0.6">{nodes}{ways}</osm>')
+    router = LocalRoutingClient(str(path))
+    assert len(router.coords) == 3
+    data = router.directions([(100.5, 13.701), (100.5, 13.707)])
+    geometry = convert.decode_polyline(data["routes"][0]["geometry"])["coordinates"]
+    assert len(geometry) == 7
+    # Shape points snap to the closer end of the street.
+    data = router.directions([(100.5005, 13.702), (100.5, 13.707)])
+    assert len(convert.decode_polyline(data["routes"][0]["geometry"])["coordinates"]) == 7
+    data = router.directions([(100.5, 13.705), (100.5, 13.707)])
+    assert len(convert.decode_polyline(data["routes"][0]["geometry"])["coordinates"]) == 2
+
+
+def test_saved_graph(tmp_path, monkeypatch):
+    path = tmp_path / "grid.osm"
+    path.write_text(_osm_xml())
+    router = LocalRoutingClient(str(path))
+    assert (tmp_path / "grid.osm.ch.json").exists()
+    coords = [router.coords[v][::-1] for v in (0, len(router.coords) - 1)]
+    expected = router.directions(coords)
+
+    def contract(self):
+        raise AssertionError("Graph is contracted again")
+
+    monkeypatch.setattr(LocalRoutingClient, "_contract", contract)
+    assert LocalRoutingClient(str(path)).directions(coords) == expected
+    # Modified extract is processed again.
+    path.write_text(_osm_xml() + " ")
+    with pytest.raises(AssertionError):
+        LocalRoutingClient(str(path))
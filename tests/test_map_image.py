@@ -0,0 +1,114 @@
+import io
+
+import pytest
+from test_utils import client
+
+from taxi_bot.api_service import map_image
+from taxi_bot.api_service.geometry import Route
+from taxi_bot.api_service.janitor import image_path
+from taxi_bot.api_service.route import _route_view, route_client
+from taxi_bot.api_service.route_cache import RouteCache
+from taxi_bot.api_service.schema import app
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def test_project():
+    assert map_image.project(0, 0, 0) == (256, 256)
+    x, y = map_image.project(85.05112878, 180, 1)
+    assert x == 1024 and abs(y) < 1e-6
+
+
+def test_save_route_image(tmp_path):
+    to_customer = Route(lon=(100.50, 100.50), lat=(13.70, 13.75))
+    ride = Route(lon=(100.50, 100.55), lat=(13.75, 13.75))
+    center, zoom = _route_view(to_customer, ride)
+    path = tmp_path / "route.png"
+    map_image.save_route_image(to_customer, ride, str(path), center, zoom)
+    image = Image.open(path)
+    assert image.size == (map_image.IMAGE_WIDTH, map_image.IMAGE_HEIGHT)
+    center_x, center_y = map_image.project(center["lat"], center["lon"], zoom)
+
+    def pixel(lat, lon):
+        x, y = map_image.project(lat, lon, zoom)
+        return image.getpixel((round(x - center_x + 350), round(y - center_y + 250)))
+
+    assert pixel(13.72, 100.50) == (0, 128, 0)
+    assert pixel(13.75, 100.53) == (0, 0, 255)
+    assert pixel(13.72, 100.53) == (229, 227, 223)
+
+
+def test_pillow_renderer(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(route_client, "upload_image_path", str(tmp_path))
+    monkeypatch.setattr(route_client, "image_settings", {"renderer": "pillow", "format": "png"})
+    url = route_client.create_route_image(
+        Route(lon=(100.50, 100.50), lat=(13.70, 13.75)),
+        Route(lon=(100.50, 100.55), lat=(13.75, 13.75)),
+    )
+    route_client.render_queue.join()
+    assert Image.open(image_path(tmp_path, url.rsplit("/", 1)[1])).format == "PNG"
+
+
+def test_image_variants(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.setattr(route_client, "upload_image_path", str(tmp_path))
+    monkeypatch.setattr(route_client, "image_settings", {"renderer": "pillow", "format": "png"})
+    url = route_client.create_route_image(
+        Route(lon=(100.50, 100.50), lat=(13.70, 13.75)),
+        Route(lon=(100.50, 100.55), lat=(13.75, 13.75)),
+    )
+    assert route_client.channel_image_url(url, "viber") == url
+    monkeypatch.setattr(route_client, "image_variants", True)
+    viber_url = route_client.channel_image_url(url, "viber")
+    telegram_url = route_client.channel_image_url(url, "telegram")
+    assert viber_url == url[: -len(".png")] + ".viber.jpg"
+    assert telegram_url == url[: -len(".png")] + ".telegram.png"
+    url = route_client.create_route_image(
+        Route(lon=(100.50, 100.50), lat=(13.70, 13.76)),
+        Route(lon=(100.50, 100.55), lat=(13.76, 13.76)),
+    )
+    viber_url = route_client.channel_image_url(url, "viber")
+    resp = client.get(viber_url[viber_url.index("/images/") :])
+    assert resp.status_code == 200 and resp.mimetype == "image/jpeg"
+    viber = Image.open(io.BytesIO(resp.data))
+    assert viber.format == "JPEG" and viber.size == (480, 343)
+    telegram_url = route_client.channel_image_url(url, "telegram")
+    resp = client.get(telegram_url[telegram_url.index("/images/") :])
+    assert resp.status_code == 200 and resp.mimetype == "image/png"
+
+
+def test_save_route_image_tiles(tmp_path):
+    tile = tmp_path / "tile.png"
+    Image.new("RGB", (256, 256), "red").save(tile)
+    requested = []
+
+    def tiles(zoom, x, y):
+        requested.append((zoom, x, y))
+        return tile.read_bytes()
+
+    route = Route(lon=(100.50, 100.50), lat=(13.70, 13.75))
+    path = tmp_path / "route.png"
+    map_image.save_route_image(route, route, str(path), {"lat": 13.72, "lon": 100.5}, 12.5)
+    assert Image.open(path).getpixel((0, 0)) == (229, 227, 223)
+    map_image.save_route_image(route, route, str(path), {"lat": 13.72, "lon": 100.5}, 12.5, tiles)
+    image = Image.open(path)
+    assert image.getpixel((0, 0)) == image.getpixel((699, 499)) == (255, 0, 0)
+    assert {zoom for zoom, _, _ in requested} == {14}
+    # 700x500 pixels are covered by tiles of about 181 pixels.
+    assert 12 <= len(requested) <= 20
+
+
+def test_ride_layer_reused(tmp_path):
+    ride_layers = RouteCache(maxsize=4)
+    ride = Route(lon=(100.50, 100.55, 100.56), lat=(13.75, 13.75, 13.76))
+    center = {"lat": 13.74, "lon": 100.52}
+    for i, lat in enumerate((13.70, 13.71)):
+        to_customer = Route(lon=(100.50, 100.50), lat=(lat, 13.75))
+        map_image.save_route_image(
+            to_customer, ride, str(tmp_path / f"{i}.png"), center, 12.2, ride_layers=ride_layers
+        )
+    assert (ride_layers.hits, ride_layers.misses) == (1, 1)
+    map_image.save_route_image(to_customer, ride, str(tmp_path / "direct.png"), center, 12.2)
+    layered = Image.open(tmp_path / "1.png")
+    direct = Image.open(tmp_path / "direct.png")
+    assert layered.tobytes() == direct.tobytes()
@@ -0,0 +1,44 @@
+from collections import namedtuple
+
+from taxi_bot.api_service import driver
+from taxi_bot.api_service.geometry import Route
+from taxi_bot.api_service.route import route_client
+
+Order = namedtuple("Order", "order_id start_latitude start_longitude")
+
+
+def _summary(start_latitude, finish_latitude):
+    # Road distance is 1.5 times longer than straight distance (about 1.11 km per 0.01°).
+    return {
+        "distance": round(abs(finish_latitude - start_latitude) * 111.2 * 1.5, 2),
+        "duration": 1,
+    }
+
+
+def test_find_nearest_order_pruning(monkeypatch):
+    matrix_calls, route_calls = [], []
+
+    def get_ors_distances(origins, destinations, deadline=None):
+        matrix_calls.append([lat for lat, _ in destinations])
+        return [_summary(origins[0][0], lat) for lat, _ in destinations]
+
+    def get_ors_route(start_latitude, start_longitude, finish_latitude, finish_longitude):
+        route_calls.append(finish_latitude)
+        return Route([], []), _summary(start_latitude, finish_latitude)
+
+    monkeypatch.setattr(driver, "MATRIX_CHUNK_SIZE", 2)
+    monkeypatch.setattr(route_client, "get_ors_distances", get_ors_distances)
+    monkeypatch.setattr(route_client, "get_ors_route", get_ors_route)
+    orders = [Order(i, 13.0 + i / 100, 100.0) for i in (5, 1, 3, 2, 30)]
+    order, _, summary = driver._find_nearest_order(13.0, 100.0, 50, orders)
+    assert order.order_id == 1 and summary["distance"] == 1.67
+    # Order 3 is 3.34 km away in straight line, which is already farther than 1.67 km by road.
+    assert matrix_calls == [[13.01, 13.02]]
+    assert route_calls == [13.01]
+
+    matrix_calls.clear()
+    route_calls.clear()
+    assert driver._find_nearest_order(13.0, 100.0, 3, orders[2:]) is None
+    # Order 30 is out of radius and never requested, order 2 is out of radius by road.
+    assert matrix_calls == [[13.02, 13.03]]
+    assert route_calls == []
@@ -0,0 +1,76 @@
+import json
+
+import httpretty
+import plotly.graph_objects as go
+from test_utils import (
+    CUSTOMER_LOCATIONS,
+    DRIVER_2_LOCATION,
+    DRIVER_BOT_URL,
+    DRIVER_LOCATION,
+    ORS_BODY,
+    ORS_MATRIX_URL,
+    ORS_URL,
+    client,
+    create_driver,
+    customer,
+    driver,
+    ors_matrix_callback,
+)
+
+from taxi_bot.api_service.geometry import Route
+from taxi_bot.api_service.route import route_client, simplify_route
+from taxi_bot.api_service.schema import OrderTable, app, db
+
+
+@httpretty.activate(allow_net_connect=False)
+def test_ride_route_once_per_order(client, customer, driver, monkeypatch):
+    monkeypatch.setattr(go.Figure, "write_image", lambda self, path: True)
+    directions = []
+
+    def directions_callback(request, uri, response_headers):
+        directions.append(json.loads(request.body)["coordinates"])
+        return [200, response_headers, json.dumps(ORS_BODY)]
+
+    httpretty.register_uri(httpretty.POST, ORS_URL, body=directions_callback)
+    httpretty.register_uri(httpretty.POST, ORS_MATRIX_URL, body=ors_matrix_callback)
+    driver_2 = create_driver(client)
+    for d, location in ((driver, DRIVER_LOCATION), (driver_2, DRIVER_2_LOCATION)):
+        httpretty.register_uri(
+            httpretty.POST, f"{DRIVER_BOT_URL}/rpc/telegram/{d['messenger_id']}"
+        )
+        resp = client.post(f"/driver/{d['id']}/request", json=dict(location=location, radius=3))
+        assert resp.status_code == 200 and not resp.json
+    resp = client.post(f"/customer/{customer['id']}/order", json=CUSTOMER_LOCATIONS)
+    assert resp.status_code == 200
+    start = CUSTOMER_LOCATIONS["start_location"]
+    finish = CUSTOMER_LOCATIONS["finish_location"]
+    ride_coordinates = [
+        [start["longitude"], start["latitude"]],
+        [finish["longitude"], finish["latitude"]],
+    ]
+    # Two routes to customer and one ride route.
+    assert len(directions) == 3 and directions.count(ride_coordinates) == 1
+    with app.app_context():
+        order = db.session.get(OrderTable, resp.json["order_id"])
+        ride_route = Route.decode(ORS_BODY["routes"][0]["geometry"])
+        assert order.ride_polyline == simplify_route(ride_route, 1).polyline
+        assert json.loads(order.ride_summary) == {"duration": 5, "distance": 2.76, "price": 3}
+
+    resp = client.post(f"/driver/{driver['id']}/decline", json={"order_id": order.order_id})
+    assert resp.status_code == 200
+    resp = client.post(f"/driver/{driver['id']}/cancel", json={})
+    assert resp.status_code == 200
+    resp = client.post(
+        f"/driver/{driver['id']}/request", json=dict(location=DRIVER_LOCATION, radius=3)
+    )
+    assert resp.status_code == 200 and not resp.json
+    directions.clear()
+    # The ride route must come from the order, not from the directions cache.
+    route_client.route_cache.clear()
+    resp = client.post(
+        f"/driver/{driver_2['id']}/request", json=dict(location=DRIVER_2_LOCATION, radius=3)
+    )
+    assert resp.status_code == 200
+    assert resp.json["ride_summary"] == {"duration": 5, "distance": 2.76, "price": 3}
+    # Only the route to customer is requested, the ride route is read from the order.
+    assert len(directions) == 1 and ride_coordinates not in directions
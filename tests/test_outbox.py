@@ -0,0 +1,312 @@
+import threading
+import time
+
+from test_utils import client, customer  # noqa: F401
+
+from taxi_bot.api_service import outbox, query
+from taxi_bot.api_service.outbox import _OutboxDispatcher
+from taxi_bot.api_service.rpc import rpc_client
+from taxi_bot.api_service.schema import (
+    CANCELED_ORDER_STATE,
+    INIT_ORDER_STATE,
+    app,
+    db,
+    is_memory_database,
+)
+
+
+def record_deliveries(monkeypatch, failing=()):
+    delivered = []
+
+    def notify_driver(messenger_id, method, params):
+        if messenger_id in failing:
+            raise ConnectionError("Bot unavailable")
+        delivered.append((messenger_id, method, params))
+
+    monkeypatch.setattr(rpc_client, "notify_driver", notify_driver)
+    monkeypatch.setattr(
+        rpc_client,
+        "notify_customer",
+        lambda channel, messenger_id, method, params: delivered.append(
+            (channel, messenger_id, method, params)
+        ),
+    )
+    return delivered
+
+
+def test_outbox_delivers_in_order(client, monkeypatch):
+    delivered = record_deliveries(monkeypatch)
+    dispatcher = _OutboxDispatcher()
+    with app.app_context():
+        outbox.notify_driver("1", "customer_found", {"order_id": 1})
+        outbox.notify_customer("viber", "2", "driver_found", {"order_id": 1})
+        outbox.notify_driver("1", "customer_canceled", {"order_id": 1})
+        db.session.commit()
+        assert dispatcher.dispatch() is None
+        assert not query.find_outbox_messages(10)
+    # Recipients are notified concurrently, each in the order the notifications were added.
+    assert [d for d in delivered if d[0] == "1"] == [
+        ("1", "customer_found", {"order_id": 1}),
+        ("1", "customer_canceled", {"order_id": 1}),
+    ]
+    assert ("viber", "2", "driver_found", {"order_id": 1}) in delivered
+    assert dispatcher.delivered == 3
+
+
+def test_outbox_retries_failed_recipient(client, monkeypatch):
+    delivered = record_deliveries(monkeypatch, failing={"1"})
+    dispatcher = _OutboxDispatcher()
+    dispatcher.max_attempts = 3
+    with app.app_context():
+        outbox.notify_driver("1", "customer_found", {"order_id": 1})
+        outbox.notify_driver("1", "customer_canceled", {"order_id": 1})
+        outbox.notify_driver("2", "customer_found", {"order_id": 2})
+        db.session.commit()
+        before = time.time()
+        next_attempt_at = dispatcher.dispatch()
+        # The second message of the failed recipient waits for the first one.
+        assert delivered == [("2", "customer_found", {"order_id": 2})]
+        assert before + 1 <= next_attempt_at <= time.time() + 1
+        first, second = query.find_outbox_messages(10)
+        assert (first.attempts, second.attempts) == (1, 0)
+        # Not due yet.
+        assert dispatcher.dispatch() == next_attempt_at
+        assert query.find_outbox_messages(10)[0].attempts == 1
+        query.update_outbox_message_attempts(first.outbox_id, 1, 0)
+        db.session.commit()
+        next_attempt_at = dispatcher.dispatch()
+        assert before + 2 <= next_attempt_at <= time.time() + 2
+        query.update_outbox_message_attempts(first.outbox_id, 2, 0)
+        db.session.commit()
+        dispatcher.dispatch()
+        assert dispatcher.dropped == 1
+        # Dropped after max_attempts, the next message of the recipient is tried right away.
+        [message] = query.find_outbox_messages(10)
+        assert (message.method, message.attempts) == ("customer_canceled", 1)
+
+
+def test_outbox_skips_messages_backing_off(client, monkeypatch):
+    delivered = record_deliveries(monkeypatch, failing={"1"})
+    dispatcher = _OutboxDispatcher()
+    dispatcher.batch_size = 2
+    with app.app_context():
+        outbox.notify_driver("1", "customer_found", {"order_id": 1})
+        outbox.notify_driver("1", "customer_canceled", {"order_id": 1})
+        outbox.notify_driver("2", "customer_found", {"order_id": 2})
+        db.session.commit()
+        now = time.time()
+        # The first batch is the failing recipient, the message past it is delivered next.
+        next_attempt_at = dispatcher.dispatch()
+        assert delivered == [("2", "customer_found", {"order_id": 2})]
+        # Only the failed recipient is left, nothing is due before its retry.
+        assert now + 1 <= next_attempt_at
+        assert dispatcher.dispatch() == next_attempt_at
+        assert dispatcher.failed == 1
+
+
+def test_outbox_notifies_recipients_concurrently(client, monkeypatch):
+    second_delivered = threading.Event()
+    delivered = []
+
+    def notify_driver(messenger_id, method, params):
+        if messenger_id == "1":
+            # Slow bot call, completes only if the other driver is notified meanwhile.
+            if not second_delivered.wait(5):
+                raise TimeoutError("Bot timeout")
+        else:
+            second_delivered.set()
+        delivered.append(messenger_id)
+
+    monkeypatch.setattr(rpc_client, "notify_driver", notify_driver)
+    dispatcher = _OutboxDispatcher()
+    with app.app_context():
+        outbox.notify_driver("1", "customer_found", {"order_id": 1})
+        outbox.notify_driver("2", "customer_found", {"order_id": 1})
+        db.session.commit()
+        dispatcher.dispatch()
+        assert not query.find_outbox_messages(10)
+    assert delivered == ["2", "1"]
+    assert dispatcher.failed == 0
+
+
+def test_outbox_sends_while_recipient_in_flight(client, monkeypatch):
+    release = threading.Event()
+    delivered = []
+
+    def notify_driver(messenger_id, method, params):
+        if messenger_id == "1" and not release.wait(5):
+            raise TimeoutError("Bot timeout")
+        delivered.append((messenger_id, method))
+
+    monkeypatch.setattr(rpc_client, "notify_driver", notify_driver)
+    dispatcher = _OutboxDispatcher()
+    with app.app_context():
+        outbox.notify_driver("1", "customer_found", {"order_id": 1})
+        db.session.commit()
+        dispatcher.dispatch(wait=False)
+        outbox.notify_driver("2", "customer_found", {"order_id": 2})
+        outbox.notify_driver("1", "customer_canceled", {"order_id": 1})
+        db.session.commit()
+        dispatcher.dispatch(wait=False)
+        # The second driver is not held back by the slow first one.
+        deadline = time.monotonic() + 5
+        while not delivered and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert delivered == [("2", "customer_found")]
+        release.set()
+        assert dispatcher.dispatch() is None
+    # The next notification of the first driver is sent after the one in flight.
+    assert delivered[1:] == [("1", "customer_found"), ("1", "customer_canceled")]
+    assert dispatcher.delivered == 3
+
+
+def test_outbox_wake_does_not_wait(client, monkeypatch):
+    release = threading.Event()
+    delivered = []
+
+    def notify_driver(messenger_id, method, params):
+        release.wait(5)
+        delivered.append(messenger_id)
+
+    monkeypatch.setattr(rpc_client, "notify_driver", notify_driver)
+    dispatcher = _OutboxDispatcher()
+    with app.app_context():
+        outbox.notify_driver("1", "customer_found", {"order_id": 1})
+        db.session.commit()
+        start = time.monotonic()
+        dispatcher.wake()
+        assert time.monotonic() - start < 1 and not delivered
+        release.set()
+        # The finished delivery is applied by a later request.
+        deadline = time.monotonic() + 5
+        while query.find_outbox_messages(10) and time.monotonic() < deadline:
+            time.sleep(0.01)
+            dispatcher.wake()
+        assert not query.find_outbox_messages(10)
+    assert delivered == ["1"] and dispatcher.delivered == 1
+
+
+def test_outbox_batches_per_bot(client, monkeypatch):
+    batches = []
+
+    def notify(bot):
+        def send(calls):
+            batches.append((bot, calls))
+            # The bot fails the first call of driver 1 and skips its next one.
+            return [
+                {"code": -32000} if messenger_id == "1" else None
+                for _, messenger_id, _, _ in calls
+            ]
+
+        return send
+
+    monkeypatch.setattr(rpc_client, "notify_drivers", notify("driver"))
+    monkeypatch.setattr(rpc_client, "notify_customers", notify("customer"))
+    dispatcher = _OutboxDispatcher()
+    dispatcher.set_config(batch=True)
+    with app.app_context():
+        outbox.notify_driver("1", "customer_found", {"order_id": 1})
+        outbox.notify_driver("2", "customer_found", {"order_id": 1})
+        outbox.notify_customer("viber", "3", "driver_found", {"order_id": 2})
+        outbox.notify_driver("1", "customer_canceled", {"order_id": 1})
+        db.session.commit()
+        dispatcher.dispatch()
+        first, second = query.find_outbox_messages(10)
+        assert (first.method, first.attempts) == ("customer_found", 1)
+        assert (second.method, second.attempts) == ("customer_canceled", 0)
+    assert sorted(batches) == [
+        ("customer", [("viber", "3", "driver_found", {"order_id": 2})]),
+        (
+            "driver",
+            [
+                ("telegram", "1", "customer_found", {"order_id": 1}),
+                ("telegram", "1", "customer_canceled", {"order_id": 1}),
+                ("telegram", "2", "customer_found", {"order_id": 1}),
+            ],
+        ),
+    ]
+    assert (dispatcher.delivered, dispatcher.failed) == (2, 1)
+
+
+def test_outbox_batch_error_codes(client, monkeypatch):
+    def notify_drivers(calls):
+        codes = {"customer_found": -32601, "customer_canceled": -32603}
+        return [{"code": codes[method]} if method in codes else None for _, _, method, _ in calls]
+
+    monkeypatch.setattr(rpc_client, "notify_drivers", notify_drivers)
+    dispatcher = _OutboxDispatcher()
+    dispatcher.set_config(batch=True)
+    with app.app_context():
+        outbox.notify_driver("1", "customer_found", {"order_id": 1})
+        outbox.notify_driver("2", "customer_canceled", {"order_id": 1})
+        db.session.commit()
+        dispatcher.dispatch()
+        # A rejected call is delivered like a single call, an internal error is retried.
+        (message,) = query.find_outbox_messages(10)
+        assert (message.messenger_id, message.attempts) == ("2", 1)
+    assert (dispatcher.delivered, dispatcher.failed) == (1, 1)
+
+
+def test_outbox_dispatcher_thread(client, monkeypatch):
+    delivered = record_deliveries(monkeypatch)
+    dispatcher = _OutboxDispatcher()
+    with app.app_context():
+        outbox.notify_driver("1", "customer_found", {"order_id": 1})
+        db.session.commit()
+    dispatcher.set_config(workers=2)
+    dispatcher.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not delivered and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        dispatcher.stop()
+    assert delivered == [("1", "customer_found", {"order_id": 1})]
+
+
+def test_outbox_keeps_latest_offer(client, monkeypatch):
+    delivered = record_deliveries(monkeypatch)
+    dispatcher = _OutboxDispatcher()
+    with app.app_context():
+        outbox.notify_driver("1", "customer_found", {"order_id": 1})
+        outbox.notify_driver("2", "customer_found", {"order_id": 1})
+        outbox.notify_driver("1", "customer_found", {"order_id": 2})
+        db.session.commit()
+        assert [(m.messenger_id, m.order_id) for m in query.find_outbox_messages(10)] == [
+            ("2", 1),
+            ("1", 2),
+        ]
+        dispatcher.dispatch()
+    assert sorted(delivered) == [
+        ("1", "customer_found", {"order_id": 2}),
+        ("2", "customer_found", {"order_id": 1}),
+    ]
+
+
+def test_outbox_drops_offers_of_inactive_orders(client, customer, monkeypatch):
+    delivered = record_deliveries(monkeypatch)
+    dispatcher = _OutboxDispatcher()
+    with app.app_context():
+        query.add_order_if_not_exists(customer["id"], 1, 1, 2, 2, None, INIT_ORDER_STATE)
+        order_id = query.find_active_customer_order_by_customer_id_for_update(
+            customer["id"]
+        ).order_id
+        outbox.notify_driver("1", "customer_found", {"order_id": order_id})
+        outbox.notify_driver("1", "customer_canceled", {"order_id": order_id})
+        query.update_order_state_by_order_id(order_id, CANCELED_ORDER_STATE)
+        db.session.commit()
+        dispatcher.dispatch()
+    assert delivered == [("1", "customer_canceled", {"order_id": order_id})]
+    assert dispatcher.stale == 1
+
+
+def test_memory_database(monkeypatch):
+    # The dispatcher thread is started by cli for databases with separate connections only.
+    assert is_memory_database()
+    for uri, expected in (
+        ("sqlite:////var/lib/taxi_bot/taxi.sqlite", False),
+        ("sqlite:///file:taxi?mode=memory&uri=true", True),
+        ("sqlite://", True),
+    ):
+        monkeypatch.setitem(app.config, "SQLALCHEMY_DATABASE_URI", uri)
+        assert is_memory_database() is expected
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from taxi_bot.api_service.render import RendererPool
+
+
+def fake_renderer():
+    def render(figure, path):
+        if figure == "crash":
+            os._exit(1)
+        if figure == "error":
+            raise ValueError(figure)
+        with open(path, "w") as f:
+            f.write(figure)
+
+    return render
+
+
+def test_renderer_pool(tmp_path):
+    pool = RendererPool(1, fake_renderer, timeout=30)
+    try:
+        pool.render("first", str(tmp_path / "first.png"))
+        assert (tmp_path / "first.png").read_text() == "first"
+        with pytest.raises(RuntimeError, match="ValueError"):
+            pool.render("error", str(tmp_path / "error.png"))
+        with pytest.raises(RuntimeError, match="Renderer process failed"):
+            pool.render("crash", str(tmp_path / "crash.png"))
+        assert pool.restarts == 1
+        pool.render("second", str(tmp_path / "second.png"))
+        assert (tmp_path / "second.png").read_text() == "second"
+    finally:
+        pool.close()
@@ -0,0 +1,213 @@
+import json
+import sys
+import threading
+import time
+from concurrent import futures
+
+import freezegun
+import httpretty
+import pytest
+from test_utils import ORS_BODY, ORS_MATRIX_URL, ORS_URL, ors_matrix_callback
+
+from taxi_bot.api_service import route
+from taxi_bot.api_service.geometry import Route
+from taxi_bot.api_service.route import route_client
+from taxi_bot.api_service.route_cache import (
+    LruCache,
+    PersistentRouteCache,
+    RouteCache,
+    SingleFlight,
+)
+
+
+@httpretty.activate(allow_net_connect=False)
+def test_get_ors_distances(monkeypatch):
+    requests = []
+
+    def callback(request, uri, response_headers):
+        requests.append(json.loads(request.body))
+        return ors_matrix_callback(request, uri, response_headers)
+
+    monkeypatch.setattr(route, "MATRIX_CHUNK_SIZE", 2)
+    # HTTPretty is not thread-safe, send chunks one by one.
+    monkeypatch.setattr(route_client, "_executor", futures.ThreadPoolExecutor(1))
+    httpretty.register_uri(httpretty.POST, ORS_MATRIX_URL, body=callback)
+    summaries = route_client.get_ors_distances([(1, 2), (3, 4), (5, 6)], [(7, 8)])
+    assert summaries == [{"duration": 5, "distance": 2.76}] * 3
+    assert [r["locations"] for r in requests] == [[[2, 1], [4, 3], [8, 7]], [[6, 5], [8, 7]]]
+    assert [(r["sources"], r["destinations"]) for r in requests] == [([0, 1], [2]), ([0], [1])]
+
+    requests.clear()
+    summaries = route_client.get_ors_distances([(7, 8)], [(1, 2), (3, 4)])
+    assert len(summaries) == 2
+    assert [(r["sources"], r["destinations"]) for r in requests] == [([2], [0, 1])]
+
+
+@httpretty.activate(allow_net_connect=False)
+def test_get_ors_distances_error():
+    httpretty.register_uri(httpretty.POST, ORS_MATRIX_URL, status=500)
+    assert route_client.get_ors_distances([(1, 2), (3, 4)], [(7, 8)]) == [None, None]
+    assert route_client.get_ors_distances([], [(7, 8)]) == []
+
+
+@httpretty.activate(allow_net_connect=False)
+def test_get_ors_route_cache():
+    httpretty.register_uri(httpretty.POST, ORS_URL, body=json.dumps(ORS_BODY))
+    route_client.route_cache.clear()
+    route, summary = route_client.get_ors_route(13.749079, 100.503572, 13.749071, 100.503577)
+    summary["price"] = 3
+    route_2, summary_2 = route_client.get_ors_route(13.7490791, 100.5035721, 13.749071, 100.503577)
+    assert summary_2 == {"duration": 5, "distance": 2.76}
+    assert route_2 is route
+    assert route_client.route_cache.hits == 1 and route_client.route_cache.misses == 1
+    route_client.get_ors_route(13.7491, 100.503572, 13.749071, 100.503577)
+    assert route_client.route_cache.misses == 2
+
+
+def test_route_cache_lru_ttl():
+    cache = RouteCache(maxsize=2, ttl=10)
+    with freezegun.freeze_time("2022-12-01 00:00:00") as frozen_time:
+        cache.put(1, "a")
+        cache.put(2, "b")
+        assert cache.get(1) == "a"
+        cache.put(3, "c")
+        assert cache.get(2) is None
+        assert cache.get(1) == "a" and cache.get(3) == "c"
+        frozen_time.tick(11)
+        assert cache.get(1) is None and len(cache) == 1
+    assert (cache.hits, cache.misses) == (3, 2)
+    cache = RouteCache(maxsize=0)
+    cache.put(1, "a")
+    assert cache.get(1) is None
+
+
+def test_lru_cache():
+    cache = LruCache(maxsize=2)
+    cache.put("a", b"1")
+    cache.put("b", b"2")
+    assert cache.get("a") == b"1"
+    cache.put("c", b"3")
+    assert cache.get("b") is None and len(cache) == 2
+    assert cache.get("a") == b"1" and cache.get("c") == b"3"
+    cache = LruCache(maxsize=0)
+    cache.put("a", b"1")
+    assert cache.get("a") is None
+
+
+def test_persistent_route_cache(tmp_path):
+    path = str(tmp_path / "routes.sqlite")
+    cache = PersistentRouteCache(path, maxsize=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    cache = PersistentRouteCache(path, maxsize=2)
+    assert len(cache) == 2 and cache.get("a") == "1" and cache.get("c") == "3"
+    cache = PersistentRouteCache(path, ttl=0)
+    assert cache.get("a") is None
+
+
+@httpretty.activate(allow_net_connect=False)
+def test_get_ors_route_persistent_cache(tmp_path):
+    client = route._RouteClient()
+    config = ("/tmp", "http://localhost/images", "ORS_KEY")
+    client.set_config(*config, route_cache_path=str(tmp_path / "routes.sqlite"))
+    httpretty.register_uri(httpretty.POST, ORS_URL, body=json.dumps(ORS_BODY))
+    route_1 = client.get_ors_route(13.749079, 100.503572, 13.749071, 100.503577)
+    httpretty.reset()
+    # Restart: new memory cache, the same file.
+    client.set_config(*config, route_cache_path=str(tmp_path / "routes.sqlite"))
+    assert client.get_ors_route(13.749079, 100.503572, 13.749071, 100.503577) == route_1
+    assert client.persistent_route_cache.hits == 1
+    # The file keeps routes longer than the memory cache.
+    client.set_config(*config, route_cache_path=str(tmp_path / "routes.sqlite"))
+    assert client.persistent_route_cache.ttl == 604800 > client.route_cache.ttl
+
+
+def test_render_workers_per_renderer_process(monkeypatch):
+    monkeypatch.setattr(route, "RendererPool", lambda processes: None)
+    client = route._RouteClient()
+    config = ("/tmp", "http://localhost/images", "ORS_KEY")
+    client.set_config(*config, image_renderer="plotly", renderer_processes=3)
+    assert len(client.render_queue._workers) == 1
+    monkeypatch.setattr(route, "RendererPool", lambda processes: object())
+    client.set_config(*config, image_renderer="plotly", renderer_processes=3)
+    assert len(client.render_queue._workers) == 3
+
+
+def test_pillow_required(monkeypatch):
+    monkeypatch.setitem(sys.modules, "PIL", None)
+    client = route._RouteClient()
+    config = ("/tmp", "http://localhost/images", "ORS_KEY")
+    client.set_config(*config)
+    with pytest.raises(ImportError, match="taxi_bot\\[pillow\\]"):
+        client.set_config(*config, image_renderer="pillow")
+    with pytest.raises(ImportError):
+        client.set_config(*config, image_variants=True)
+
+
+def test_get_ors_routes_deadline(monkeypatch):
+    client = route._RouteClient()
+    client.route_deadline = 0.2
+    release = threading.Event()
+
+    def get_ors_route(start_latitude, start_longitude, finish_latitude, finish_longitude):
+        if start_latitude == 2:
+            release.wait(5)
+        return start_latitude
+
+    monkeypatch.setattr(client, "get_ors_route", get_ors_route)
+    started = time.monotonic()
+    assert client.get_ors_routes([(1, 0, 0, 0), (2, 0, 0, 0), (3, 0, 0, 0)]) == [1, None, 3]
+    assert time.monotonic() - started < 1
+    # The second phase of the same API request gets only the rest of the deadline.
+    deadline = client.deadline()
+    client.get_ors_routes([(1, 0, 0, 0), (2, 0, 0, 0)], deadline)
+    started = time.monotonic()
+    assert client.get_ors_routes([(1, 0, 0, 0), (2, 0, 0, 0)], deadline)[1] is None
+    assert time.monotonic() - started < 0.1
+    release.set()
+
+
+def test_single_flight():
+    single_flight = SingleFlight()
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    def func():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "route"
+
+    with futures.ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(single_flight.do, "key", func)
+        started.wait(5)
+        followers = [executor.submit(single_flight.do, "key", func) for _ in range(3)]
+        while single_flight.shared < 3:
+            time.sleep(0.01)
+        release.set()
+        assert [f.result() for f in [leader, *followers]] == ["route"] * 4
+    assert len(calls) == 1
+    assert single_flight.do("key", lambda: "new route") == "new route"
+
+    def error():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        single_flight.do("key", error)
+
+
+def test_simplify_route():
+    ors_route = Route.decode(ORS_BODY["routes"][0]["geometry"])
+    assert route.simplify_route(ors_route, 0) is ors_route
+    simplified = route.simplify_route(ors_route, 1)
+    assert 2 < len(simplified) < len(ors_route) / 5
+    assert simplified.lat[0] == ors_route.lat[0]
+    assert simplified.lon[-1] == ors_route.lon[-1]
+    assert Route.decode(simplified.polyline) == simplified
+    # A point 0.1 m off the straight line is dropped, the corner is kept.
+    corner = Route(lon=(100.5, 100.505, 100.51, 100.51), lat=(13.7, 13.7000009, 13.7, 13.71))
+    simplified = route.simplify_route(corner, 1)
+    assert list(simplified.lat) == [13.7, 13.7, 13.71]
+    assert list(simplified.lon) == [100.5, 100.51, 100.51]
@@ -0,0 +1,84 @@
+import json
+import threading
+
+import httpretty
+import pytest
+from test_utils import DRIVER_BOT_URL
+from urllib3.exceptions import EmptyPoolError
+
+from taxi_bot.api_service.rpc import RpcError, _RpcClient
+
+
+def test_rpc_session_config():
+    rpc_client = _RpcClient()
+    rpc_client.set_config(DRIVER_BOT_URL, DRIVER_BOT_URL, 4, 1, 5, 3, keep_alive=False)
+    assert rpc_client.timeout == (1, 5)
+    adapter = rpc_client.driver_session.get_adapter(DRIVER_BOT_URL)
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 3
+    # POST requests are retried only if they were not sent.
+    assert "POST" not in adapter.max_retries.allowed_methods
+    assert rpc_client.customer_session.headers["Connection"] == "close"
+
+
+def test_rpc_pool_wait():
+    rpc_client = _RpcClient()
+    rpc_client.set_config(DRIVER_BOT_URL, DRIVER_BOT_URL, pool_size=1, connect_timeout=0.05)
+    adapter = rpc_client.driver_session.get_adapter(DRIVER_BOT_URL)
+    pool = adapter.poolmanager.connection_from_url(DRIVER_BOT_URL)
+    conn = pool._get_conn()
+    assert rpc_client.pool_waits == 0
+    # The only connection is in use, the next call waits for connect_timeout.
+    with pytest.raises(EmptyPoolError):
+        pool._get_conn()
+    assert rpc_client.pool_waits == 1
+    assert 0.05 <= rpc_client.pool_wait_max <= rpc_client.pool_wait_seconds
+    pool._put_conn(conn)
+
+
+@httpretty.activate(allow_net_connect=False)
+def test_rpc_notify_driver():
+    rpc_client = _RpcClient()
+    rpc_client.set_config(DRIVER_BOT_URL, DRIVER_BOT_URL)
+    httpretty.register_uri(httpretty.POST, f"{DRIVER_BOT_URL}/rpc/telegram/1")
+    rpc_client.notify_driver("1", "customer_canceled", {"order_id": 1})
+    assert httpretty.last_request().parsed_body == {
+        "method": "customer_canceled",
+        "params": {"order_id": 1},
+    }
+    assert rpc_client.pool_wait_seconds < 0.05
+
+
+@httpretty.activate(allow_net_connect=False)
+def test_rpc_batch_request():
+    rpc_client = _RpcClient()
+    rpc_client.set_config(DRIVER_BOT_URL, DRIVER_BOT_URL)
+    httpretty.register_uri(
+        httpretty.POST,
+        f"{DRIVER_BOT_URL}/rpc/batch",
+        body=json.dumps({"result": [{"result": None}, {"error": {"code": -32100}}]}),
+    )
+    errors = rpc_client.notify_customers(
+        [
+            ("viber", "2", "ride_started", {"order_id": 1}),
+            ("unknown", "3", "ride_started", {"order_id": 2}),
+        ]
+    )
+    assert errors == [None, {"code": -32100}]
+    assert httpretty.last_request().parsed_body == [
+        {"channel": "viber", "user_id": "2", "method": "ride_started", "params": {"order_id": 1}},
+        {
+            "channel": "unknown",
+            "user_id": "3",
+            "method": "ride_started",
+            "params": {"order_id": 2},
+        },
+    ]
+    assert rpc_client.batches == 1
+    httpretty.register_uri(
+        httpretty.POST,
+        f"{DRIVER_BOT_URL}/rpc/batch",
+        body=json.dumps({"error": {"code": -32600, "message": "Invalid Request"}}),
+    )
+    with pytest.raises(RpcError):
+        rpc_client.notify_drivers([("telegram", "1", "customer_canceled", {"order_id": 1})])
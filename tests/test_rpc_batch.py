@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+sanic = pytest.importorskip("sanic")
+pytest.importorskip("sanic_testing")
+pytest.importorskip("maxbot")
+
+from maxbot import MaxBot  # noqa: E402
+from maxbot.rpc import RpcError, RpcManager  # noqa: E402
+
+from taxi_bot import rpc_batch  # noqa: E402
+from taxi_bot.rpc_batch import SKIPPED_ERROR_CODE  # noqa: E402
+from taxi_bot.webapp import create_webapp  # noqa: E402
+
+
+@pytest.fixture
+def batch_app():
+    calls = []
+
+    async def callback(request, channel, user_id):
+        if request["method"] == "unknown":
+            raise RpcError("Method not found", -32601, request["method"])
+        if request["method"] == "crash":
+            raise ValueError("Bot failure")
+        # Slow first call of a user, the next ones must still come after it.
+        if request["params"].get("slow"):
+            await asyncio.sleep(0.05)
+        calls.append((channel, user_id, request["method"]))
+
+    channels = {"telegram": "telegram", "viber": "viber"}
+    app = sanic.Sanic("rpc_batch_test")
+    app.blueprint(RpcManager().blueprint(channels, callback))
+    app.blueprint(rpc_batch.blueprint(channels, callback))
+    yield app, calls
+    sanic.Sanic._app_registry.pop("rpc_batch_test", None)
+
+
+def test_rpc_batch_results(batch_app):
+    app, calls = batch_app
+    body = [
+        {"channel": "telegram", "user_id": "1", "method": "a", "params": {"slow": True}},
+        {"channel": "viber", "user_id": "2", "method": "unknown"},
+        {"channel": "telegram", "user_id": "1", "method": "b"},
+        {"channel": "viber", "user_id": "2", "method": "c"},
+        {"channel": "whatsapp", "user_id": "3", "method": "a"},
+        {"channel": "telegram", "user_id": "4", "method": "crash"},
+        {"channel": "telegram", "user_id": "4", "method": "d"},
+        "not an object",
+    ]
+    _, response = app.test_client.post("/rpc/batch", json=body)
+    assert response.status == 200
+    codes = [(r.get("error") or {}).get("code") for r in response.json["result"]]
+    assert codes == [None, -32601, None, None, -32100, -32603, SKIPPED_ERROR_CODE, -32600]
+    # Calls of one user run in order, the slow call of user 1 does not delay user 2.
+    assert [c for c in calls if c[1] == "1"] == [("telegram", "1", "a"), ("telegram", "1", "b")]
+    # A rejected call is final like a single call, the calls after an internal error are skipped.
+    assert ("viber", "2", "c") in calls
+    assert ("telegram", "4", "d") not in calls
+
+
+def test_rpc_batch_invalid_body(batch_app):
+    app, calls = batch_app
+    _, response = app.test_client.post("/rpc/batch", json={"channel": "telegram"})
+    assert response.json["error"]["code"] == -32600
+    assert not calls
+
+
+def test_webapp_routes():
+    app = create_webapp(MaxBot(), "rpc_batch_webapp_test")
+    try:
+        app.router.finalize()
+        paths = sorted(route.path for route in app.router.routes)
+        assert paths == ["rpc/<channel_name:str>/<user_id:str>", "rpc/batch"]
+    finally:
+        sanic.Sanic._app_registry.pop("rpc_batch_webapp_test", None)
@@ -0,0 +1,77 @@
+import os
+
+import httpretty
+import pytest
+from test_utils import client
+
+from taxi_bot.api_service import map_image
+from taxi_bot.api_service.geometry import Route
+from taxi_bot.api_service.route import _route_view, _save_route_image, route_client
+from taxi_bot.api_service.tile_cache import TileCache
+
+TILE_URL = "http://tiles.test/{z}/{x}/{y}.png"
+
+
+@httpretty.activate(allow_net_connect=False)
+def test_tile_cache(tmp_path):
+    httpretty.register_uri(httpretty.GET, "http://tiles.test/1/0/0.png", body=b"a" * 100)
+    httpretty.register_uri(httpretty.GET, "http://tiles.test/1/0/1.png", body=b"b" * 100)
+    httpretty.register_uri(httpretty.GET, "http://tiles.test/1/1/0.png", status=500)
+    with pytest.raises(ValueError):
+        TileCache(str(tmp_path), TILE_URL)
+    cache = TileCache(str(tmp_path), TILE_URL, max_bytes=150, user_agent="taxi_bot (ops@test)")
+    assert cache.get(1, 0, 0) == b"a" * 100
+    assert cache.get(1, 0, 0) == b"a" * 100
+    assert len(httpretty.latest_requests()) == 1
+    assert httpretty.last_request().headers["User-Agent"] == "taxi_bot (ops@test)"
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.get(1, 1, 0) is None
+    # The second tile exceeds the size budget, the least recently used one is removed.
+    assert cache.get(1, 0, 1) == b"b" * 100
+    assert not os.path.exists(tmp_path / "1" / "0" / "0.png")
+    assert os.path.exists(tmp_path / "1" / "0" / "1.png")
+
+    local = TileCache(str(tmp_path), None)
+    assert local.get(1, 0, 1) == b"b" * 100
+    assert local.get(1, 0, 0) is None
+
+
+@httpretty.activate(allow_net_connect=False)
+def test_download_tile(client, tmp_path, monkeypatch):
+    httpretty.register_uri(httpretty.GET, "http://tiles.test/2/1/4.png", body=b"png")
+    (tmp_path / "2" / "1").mkdir(parents=True)
+    (tmp_path / "2" / "1" / "3.png").write_bytes(b"png")
+    tile_cache = TileCache(str(tmp_path), TILE_URL, user_agent="taxi_bot (ops@test)")
+    monkeypatch.setattr(route_client, "tile_cache", tile_cache)
+    resp = client.get("/tiles/2/1/3.png")
+    assert resp.status_code == 200 and resp.data == b"png" and resp.mimetype == "image/png"
+    # Missing tiles are not downloaded for clients.
+    assert client.get("/tiles/2/1/4.png").status_code == 404
+    assert not httpretty.latest_requests()
+
+
+def test_plotly_image_tiles(tmp_path):
+    requested = []
+
+    class Tiles:
+        def get(self, zoom, x, y):
+            requested.append((zoom, x, y))
+
+    class Renderer:
+        def render(self, figure, path):
+            assert requested
+
+    to_customer = Route(lon=(100.50, 100.50), lat=(13.70, 13.75))
+    ride = Route(lon=(100.50, 100.55), lat=(13.75, 13.75))
+    _save_route_image(
+        to_customer, ride, str(tmp_path / "route.png"), Renderer(), TILE_URL, Tiles()
+    )
+    center, zoom = _route_view(to_customer, ride)
+    # The tiles of the image are cached before plotly loads them from the service.
+    tile_zoom = round(zoom)
+    assert sorted(requested) == sorted(
+        (tile_zoom, x, y) for x, y in map_image.covering_tiles(center, zoom, tile_zoom)
+    )
+    x, y = map_image.project(center["lat"], center["lon"], zoom)
+    size = map_image.WORLD_SIZE * 2**zoom / 2**tile_zoom
+    assert (tile_zoom, int(x // size), int(y // size)) in requested
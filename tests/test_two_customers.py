@@ -7,13 +7,12 @@ from test_utils import (
     CUSTOMER_LOCATIONS,
     DRIVER_BOT_URL,
     DRIVER_LOCATION,
-    ORS_BODY,
-    ORS_URL,
     client,
     create_customer,
     customer,
     delete_ors_keys,
     driver,
+    register_ors,
 )
 
 CUSTOMER_2_LOCATIONS = {
@@ -35,11 +34,7 @@ def test_full_ride_two_customer(client, customer, driver, monkeypatch):
     httpretty.register_uri(
         httpretty.POST, f"{DRIVER_BOT_URL}/rpc/telegram/{driver['messenger_id']}"
     )
-    httpretty.register_uri(
-        httpretty.POST,
-        f"{ORS_URL}",
-        body=json.dumps(ORS_BODY),
-    )
+    register_ors()
     resp = client.post(f"/customer/{customer['id']}/order", json=CUSTOMER_LOCATIONS)
     assert resp.status_code == 200 and resp.json["order_id"]
     order_1 = resp.json["order_id"]
@@ -1,9 +1,13 @@
+import json
 import random
 import string
 
+import httpretty
 import pytest
 
 from taxi_bot.api_service import common, customer, driver
+from taxi_bot.api_service.geo_index import driver_index
+from taxi_bot.api_service.outbox import outbox_dispatcher
 from taxi_bot.api_service.route import route_client
 from taxi_bot.api_service.rpc import rpc_client
 from taxi_bot.api_service.schema import app, db
@@ -14,6 +18,7 @@ DRIVER_BOT_URL = "http://127.0.0.1:5001"
 CUSTOMER_BOT_URL = "http://127.0.0.1:5001"
 ORS_KEY = "ORS_KEY"
 ORS_URL = "https://api.openrouteservice.org/v2/directions/driving-car/json"
+ORS_MATRIX_URL = "https://api.openrouteservice.org/v2/matrix/driving-car/json"
 
 
 ORS_BODY = {
@@ -48,6 +53,23 @@ rpc_client.set_config(DRIVER_BOT_URL, CUSTOMER_BOT_URL)
 route_client.set_config("/tmp", f"{IMAGE_STORAGE_URL}/images", ORS_KEY)
 
 
+def ors_matrix_callback(request, uri, response_headers):
+    """Return the same summary as ORS_BODY for every matrix element."""
+    params = json.loads(request.body)
+    summary = ORS_BODY["routes"][0]["summary"]
+    rows, columns = len(params["sources"]), len(params["destinations"])
+    body = {
+        "distances": [[summary["distance"]] * columns for _ in range(rows)],
+        "durations": [[summary["duration"]] * columns for _ in range(rows)],
+    }
+    return [200, response_headers, json.dumps(body)]
+
+
+def register_ors():
+    httpretty.register_uri(httpretty.POST, ORS_URL, body=json.dumps(ORS_BODY))
+    httpretty.register_uri(httpretty.POST, ORS_MATRIX_URL, body=ors_matrix_callback)
+
+
 def rand_phone_number():
     return "".join(random.choices(string.digits, k=10))
 
@@ -57,11 +79,17 @@ def rand_messenger_id():
 
 
 @pytest.fixture
-def client():
+def client(monkeypatch):
     random.seed()
+    # Deliver notifications before the response, so the tests see the bot calls right away.
+    monkeypatch.setattr(outbox_dispatcher, "wake", outbox_dispatcher.dispatch)
     with app.app_context():
         db.drop_all()
         db.create_all()
+    driver_index.clear()
+    route_client.route_cache.clear()
+    route_client.render_queue.join()
+    route_client.image_cache.clear()
     return app.test_client()
 
 